@@ -1,5 +1,11 @@
-from hashlib import sha256
-from copy import deepcopy
+from copy import copy, deepcopy
+from itertools import permutations, product
+from zlib import crc32
+import heapq
+import mmap
+import os
+import csv
+import json
 import numpy as np
 
 
@@ -9,7 +15,7 @@ import numpy as np
 
 """incidence list represemting a graph"""
 class IncidenceList:
-    def __init__(self, edges=None, nodes=None):
+    def __init__(self, edges=None, nodes=None, outgoing=None, incoming=None):
         if edges == None:
             edges = {}
         if nodes == None:
@@ -17,15 +23,41 @@ class IncidenceList:
         self.edges = edges
         self.nodes = nodes
 
+        # adjacency index, entity -> predicate -> objects/subjects, so lookups around an entity don't need to scan a whole predicate
+        if outgoing == None or incoming == None:
+            outgoing = {}
+            incoming = {}
+            for p, pairs in edges.items():
+                for x, y in pairs:
+                    outgoing.setdefault(x, {}).setdefault(p, set()).add(y)
+                    incoming.setdefault(y, {}).setdefault(p, set()).add(x)
+        self.outgoing = outgoing
+        self.incoming = incoming
+        # (s, o) -> predicates between them, built on first use by pair_predicates
+        self.pair_index = None
+
 
     def copy(self):
         copied_edges = {key: value.copy() for key, value in self.edges.items()}
         copied_nodes = {key: value.copy() for key, value in self.nodes.items()}
-        return IncidenceList(copied_edges, copied_nodes)
+        copied_outgoing = {key: {p: e.copy() for p, e in value.items()} for key, value in self.outgoing.items()}
+        copied_incoming = {key: {p: e.copy() for p, e in value.items()} for key, value in self.incoming.items()}
+        return IncidenceList(copied_edges, copied_nodes, copied_outgoing, copied_incoming)
     
     def __repr__(self):
         return f"Graph:\nedges: {self.edges},\nnodes: {self.nodes}.\n"
 
+    # terms are stored as they are, see EncodedIncidenceList for the integer variant
+    def encode(self, term):
+        return term
+
+    def decode(self, term):
+        return term
+
+    """empty graph of the same kind"""
+    def empty(self):
+        return IncidenceList()
+
 
     def addNode(self, n, edges=None):
         if edges == None:
@@ -41,45 +73,605 @@ class IncidenceList:
         del self.nodes[n]
 
     def add(self, x, l, y):
-        self.addNode(x, {l})
-        self.addNode(y, {l})
-        if not l in self.edges:
-            self.edges[l] = {(x,y)}
-        else:
-            if not (x,y) in self.edges[l]:
-                self.edges[l].add((x,y))
+        self.add_triples(((x, l, y),))
+
+    """bulk version of add for the parser, same result as calling add for every (s, p, o)"""
+    def add_triples(self, triples):
+        nodes, edges, outgoing, incoming, pair_index = self.nodes, self.edges, self.outgoing, self.incoming, self.pair_index
+        for x, l, y in triples:
+            if x in nodes:
+                nodes[x].add(l)
+            else:
+                nodes[x] = {l}
+            if y in nodes:
+                nodes[y].add(l)
+            else:
+                nodes[y] = {l}
+            if l in edges:
+                edges[l].add((x,y))
+            else:
+                edges[l] = {(x,y)}
+            out = outgoing.get(x)
+            if out == None:
+                outgoing[x] = {l: {y}}
+            elif l in out:
+                out[l].add(y)
+            else:
+                out[l] = {y}
+            inc = incoming.get(y)
+            if inc == None:
+                incoming[y] = {l: {x}}
+            elif l in inc:
+                inc[l].add(x)
+            else:
+                inc[l] = {x}
+            if pair_index != None:
+                pair_index.setdefault((x, y), set()).add(l)
         
     def delete(self, l):
+        for x, y in self.edges[l]:
+            self.outgoing[x].pop(l, None)
+            self.incoming[y].pop(l, None)
         del self.edges[l]
+        self.pair_index = None
         return
     
     def triples(self):
         return {(pair[0], p, pair[1])  for p in self.edges for pair in self.edges[p]}
+
+    """(predicate, objects) for all edges leaving n"""
+    def out_edges(self, n):
+        return self.outgoing.get(n, {}).items()
+
+    """(predicate, subjects) for all edges entering n"""
+    def in_edges(self, n):
+        return self.incoming.get(n, {}).items()
+
+    def objects(self, s, p):
+        return self.outgoing.get(s, {}).get(p, ())
+
+    def subjects(self, o, p):
+        return self.incoming.get(o, {}).get(p, ())
+
+    def has_triple(self, s, p, o):
+        return o in self.objects(s, p)
+
+    """predicates of all edges from s to o"""
+    def pair_predicates(self, s, o):
+        if self.pair_index == None:
+            self.pair_index = {}
+            for x, out in self.outgoing.items():
+                for p, objects in out.items():
+                    for y in objects:
+                        self.pair_index.setdefault((x, y), set()).add(p)
+        return self.pair_index.get((s, o), ())
+
+    def degree(self, n):
+        return sum(len(e) for e in self.outgoing.get(n, {}).values()) + sum(len(e) for e in self.incoming.get(n, {}).values())
+
+    """(s, o) pairs of predicate p"""
+    def pairs(self, p):
+        return self.edges.get(p, ())
+
+    def edge_count(self, p):
+        return len(self.edges.get(p, ()))
+
+    def predicates(self):
+        return self.edges.keys()
+
+    """predicates of all edges at n, in either direction"""
+    def node_predicates(self, n):
+        return self.nodes.get(n, ())
+
+    def entities(self):
+        return self.nodes.keys()
     
     def neighbors(self, n):
         neighbors = set()
-        edges = self.nodes.get(n)
-        if edges:
-            for edge in edges:
-                for pair in self.edges[edge]:
-                    if n in pair:
-                        if n in pair[0]:
-                            neighbors.add(pair[1])
-                        else:
-                            neighbors.add(pair[0])
+        for _, objects in self.out_edges(n):
+            neighbors.update(objects)
+        for _, subjects in self.in_edges(n):
+            neighbors.update(subjects)
         return neighbors
     
 
 
 
-"""class that holds all information on predicate mappings for a kg and specific target"""
+"""bidirectional dictionary between terms and integer ids, ids are given out in order of first occurence"""
+class TermDict:
+    def __init__(self, terms=None):
+        if terms == None:
+            terms = []
+        self.terms = terms
+        self.ids = {t: i for i, t in enumerate(terms)}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.ids
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.terms)} terms)"
+
+    """get id of term, term is added if it is unknown"""
+    def encode(self, term:str):
+        i = self.ids.get(term)
+        if i == None:
+            i = len(self.terms)
+            self.ids[term] = i
+            self.terms.append(term)
+        return i
+
+    """get id of term without adding it, None if unknown"""
+    def lookup(self, term:str):
+        return self.ids.get(term)
+
+    def decode(self, i:int):
+        return self.terms[i]
+
+
+
+"""
+read-only term dict of a graph snapshot, the terms are memory mapped.
+    data -- utf-8 encoded terms, one after another
+    offsets -- start of term i in data at offsets[i], end at offsets[i+1]
+    table -- open addressing hash table (crc32, linear probing) holding ids, -1 for empty slots
+terms that are encoded after loading are kept in memory and get ids after the mapped ones.
+"""
+class MappedTermDict:
+    def __init__(self, data, offsets, table):
+        self.data = data
+        self.offsets = offsets
+        self.table = table
+        self.mask = len(table) - 1
+        self.mapped = len(offsets) - 1
+        self.added = []
+        self.added_ids = {}
+
+    def __len__(self):
+        return self.mapped + len(self.added)
+
+    def __contains__(self, term):
+        return self.lookup(term) != None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.mapped} mapped terms, {len(self.added)} added terms)"
+
+    """writes the terms of a TermDict in the format read by MappedTermDict.load"""
+    @staticmethod
+    def save(terms:TermDict, directory:str):
+        encoded = [t.encode("utf-8") for t in terms.terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        size = 1
+        while size < 2 * len(encoded):
+            size *= 2
+        table = [-1] * size
+        for i, b in enumerate(encoded):
+            h = crc32(b) & (size - 1)
+            while table[h] != -1:
+                h = (h + 1) & (size - 1)
+            table[h] = i
+        with open(f"{directory}/terms.bin", "wb") as file:
+            file.write(b"".join(encoded))
+        np.save(f"{directory}/term_offsets.npy", offsets)
+        np.save(f"{directory}/term_table.npy", np.array(table, dtype=np.int64))
+
+    @classmethod
+    def load(cls, directory:str):
+        with open(f"{directory}/terms.bin", "rb") as file:
+            if os.fstat(file.fileno()).st_size:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = b""
+        return cls(data, np.load(f"{directory}/term_offsets.npy", mmap_mode="r"), np.load(f"{directory}/term_table.npy", mmap_mode="r"))
+
+    def encode(self, term:str):
+        i = self.lookup(term)
+        if i == None:
+            i = self.mapped + len(self.added)
+            self.added_ids[term] = i
+            self.added.append(term)
+        return i
+
+    def lookup(self, term:str):
+        b = term.encode("utf-8")
+        h = crc32(b) & self.mask
+        while True:
+            i = int(self.table[h])
+            if i < 0:
+                return self.added_ids.get(term)
+            start, end = self.offsets[i:i + 2].tolist()
+            if self.data[start:end] == b:
+                return i
+            h = (h + 1) & self.mask
+
+    def decode(self, i:int):
+        if i >= self.mapped:
+            return self.added[i - self.mapped]
+        start, end = self.offsets[i:i + 2].tolist()
+        return self.data[start:end].decode("utf-8")
+
+
+
+"""incidence list holding integer ids instead of terms, the terms are kept in a TermDict that is shared with copies of the graph"""
+class EncodedIncidenceList(IncidenceList):
+    def __init__(self, edges=None, nodes=None, terms=None, outgoing=None, incoming=None):
+        super().__init__(edges, nodes, outgoing, incoming)
+        if terms == None:
+            terms = TermDict()
+        self.terms = terms
+
+    def copy(self):
+        copied = super().copy()
+        return EncodedIncidenceList(copied.edges, copied.nodes, self.terms, copied.outgoing, copied.incoming)
+
+    def __repr__(self):
+        return f"Graph:\nedges: {self.edges},\nnodes: {self.nodes},\nterms: {self.terms}.\n"
+
+    def encode(self, term:str):
+        return self.terms.encode(term)
+
+    def decode(self, i:int):
+        return self.terms.decode(i)
+
+    def empty(self):
+        return EncodedIncidenceList(terms=self.terms)
+
+
+
+"""
+read-only graph over integer ids, built from an EncodedIncidenceList once the graph doesn't change anymore.
+offers the same lookups as IncidenceList, but keeps the triples in sorted numpy arrays:
+    - per entity (compressed sparse rows indexed by id): outgoing (p, o) sorted by p, o and incoming (p, s) sorted by p, s
+    - per predicate: (s, o) sorted by s, o
+"""
+class FrozenGraph:
+    # names of the arrays that make up the graph, also the file names of a snapshot
+    ARRAYS = ("out_ptr", "out_p", "out_o", "in_ptr", "in_p", "in_s", "p_ptr", "ps_s", "ps_o")
+
+    def __init__(self, arrays:dict, terms:TermDict):
+        self.terms = terms
+        for name in FrozenGraph.ARRAYS:
+            setattr(self, name, arrays[name])
+        # ids that are added to the term dict after freezing have no edges
+        self.size = len(self.out_ptr) - 1
+        # s * size + o of all triples in ascending order with their predicates, built on first use by pair_predicates
+        self.pair_keys = None
+        self.pair_p = None
+
+    """builds a FrozenGraph from triple id arrays, duplicates are dropped"""
+    @classmethod
+    def from_triples(cls, s, p, o, terms:TermDict):
+        size = len(terms)
+        dtype = np.int32 if size < 2**31 else np.int64
+        s = np.asarray(s, dtype=dtype)
+        p = np.asarray(p, dtype=dtype)
+        o = np.asarray(o, dtype=dtype)
+
+        # row pointers for ids sorted in ascending order
+        def pointers(ids):
+            return np.searchsorted(ids, np.arange(size + 1)).astype(np.int64)
+
+        # sort by s, p, o and drop duplicate triples
+        order = np.lexsort((o, p, s))
+        s, p, o = s[order], p[order], o[order]
+        if len(s):
+            keep = np.ones(len(s), dtype=bool)
+            keep[1:] = (s[1:] != s[:-1]) | (p[1:] != p[:-1]) | (o[1:] != o[:-1])
+            s, p, o = s[keep], p[keep], o[keep]
+
+        arrays = {"out_ptr": pointers(s), "out_p": p, "out_o": o}
+
+        order = np.lexsort((s, p, o))
+        arrays["in_ptr"] = pointers(o[order])
+        arrays["in_p"] = p[order]
+        arrays["in_s"] = s[order]
+
+        order = np.lexsort((o, s, p))
+        arrays["p_ptr"] = pointers(p[order])
+        arrays["ps_s"] = s[order]
+        arrays["ps_o"] = o[order]
+        return cls(arrays, terms)
+
+    """builds a FrozenGraph from an EncodedIncidenceList, sharing its term dict"""
+    @classmethod
+    def from_incidence_list(cls, kg:EncodedIncidenceList):
+        n = sum(len(pairs) for pairs in kg.edges.values())
+        s = np.fromiter((x for pairs in kg.edges.values() for x, _ in pairs), dtype=np.int64, count=n)
+        o = np.fromiter((y for pairs in kg.edges.values() for _, y in pairs), dtype=np.int64, count=n)
+        p = np.repeat(np.fromiter(kg.edges.keys(), dtype=np.int64, count=len(kg.edges)), [len(pairs) for pairs in kg.edges.values()])
+        return cls.from_triples(s, p, o, kg.terms)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.out_p)} triples, {self.terms})"
+
+    def __len__(self):
+        return len(self.out_p)
+
+    def encode(self, term:str):
+        return self.terms.encode(term)
+
+    def decode(self, i:int):
+        return self.terms.decode(i)
+
+    """mutable graph of the same kind, e.g. for filtering"""
+    def empty(self):
+        return EncodedIncidenceList(terms=self.terms)
+
+    # (predicate, entities) groups of one row
+    def __groups(self, ptr, preds, entities, n):
+        if n >= self.size:
+            return []
+        a, b = ptr[n:n + 2].tolist()
+        if a == b:
+            return []
+        row = preds[a:b].tolist()
+        values = entities[a:b].tolist()
+        out = []
+        start = 0
+        for i in range(1, len(row)):
+            if row[i] != row[start]:
+                out.append((row[start], values[start:i]))
+                start = i
+        out.append((row[start], values[start:]))
+        return out
+
+    # slice of row n that holds predicate p
+    def __span(self, ptr, preds, n, p):
+        if n >= self.size:
+            return 0, 0
+        a, b = ptr[n:n + 2].tolist()
+        row = preds[a:b]
+        return a + int(row.searchsorted(p, 'left')), a + int(row.searchsorted(p, 'right'))
+
+    def out_edges(self, n):
+        return self.__groups(self.out_ptr, self.out_p, self.out_o, n)
+
+    def in_edges(self, n):
+        return self.__groups(self.in_ptr, self.in_p, self.in_s, n)
+
+    def objects(self, s, p):
+        i, j = self.__span(self.out_ptr, self.out_p, s, p)
+        return self.out_o[i:j].tolist()
+
+    def subjects(self, o, p):
+        i, j = self.__span(self.in_ptr, self.in_p, o, p)
+        return self.in_s[i:j].tolist()
+
+    def has_triple(self, s, p, o):
+        i, j = self.__span(self.out_ptr, self.out_p, s, p)
+        if i == j:
+            return False
+        k = i + int(self.out_o[i:j].searchsorted(o))
+        return k < j and int(self.out_o[k]) == o
+
+    def pair_predicates(self, s, o):
+        if s >= self.size or o >= self.size:
+            return []
+        if self.pair_keys is None:
+            subjects = np.repeat(np.arange(self.size, dtype=np.int64), np.diff(self.out_ptr))
+            keys = subjects * self.size + self.out_o
+            # rows are sorted by p, o, a stable sort keeps the predicates of a pair in order
+            order = np.argsort(keys, kind='stable')
+            self.pair_keys = keys[order]
+            self.pair_p = self.out_p[order]
+        key = s * self.size + o
+        i, j = self.pair_keys.searchsorted((key, key + 1)).tolist()
+        return self.pair_p[i:j].tolist()
+
+    def degree(self, n):
+        if n >= self.size:
+            return 0
+        return int(self.out_ptr[n + 1] - self.out_ptr[n] + self.in_ptr[n + 1] - self.in_ptr[n])
+
+    def pairs(self, p):
+        if p >= self.size:
+            return []
+        a, b = self.p_ptr[p:p + 2].tolist()
+        return list(zip(self.ps_s[a:b].tolist(), self.ps_o[a:b].tolist()))
+
+    def edge_count(self, p):
+        if p >= self.size:
+            return 0
+        return int(self.p_ptr[p + 1] - self.p_ptr[p])
+
+    def predicates(self):
+        return np.flatnonzero(np.diff(self.p_ptr)).tolist()
+
+    def node_predicates(self, n):
+        if n >= self.size:
+            return set()
+        a, b = self.out_ptr[n:n + 2].tolist()
+        c, d = self.in_ptr[n:n + 2].tolist()
+        return set(self.out_p[a:b].tolist()) | set(self.in_p[c:d].tolist())
+
+    def entities(self):
+        return np.flatnonzero(np.diff(self.out_ptr) + np.diff(self.in_ptr)).tolist()
+
+
+
+
+"""
+statistics of a graph, built in one pass over its triples.
+    predicates -- predicate -> [triples, distinct subjects, distinct objects, out-degree percentiles, in-degree percentiles],
+                  the degree percentiles (PERCENTILES) are over the subjects/objects of the predicate
+    degrees -- percentiles 0 to 100 of the degree of all entities
+    hub_degree -- entities with a higher degree are not expanded during mining, None for no limit
+"""
+class GraphStatistics:
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, predicates=None, degrees=None):
+        if predicates == None:
+            predicates = {}
+        if degrees == None:
+            degrees = []
+        self.predicates = predicates
+        self.degrees = degrees
+        self.hub_degree = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.predicates)} predicates)"
+
+    """statistics of a FrozenGraph or IncidenceList"""
+    @classmethod
+    def from_graph(cls, kg):
+        if isinstance(kg, FrozenGraph):
+            s, o = kg.ps_s, kg.ps_o
+            p = np.repeat(np.arange(len(kg.p_ptr) - 1), np.diff(kg.p_ptr))
+        else:
+            n = sum(len(pairs) for pairs in kg.edges.values())
+            ids = {q: i for i, q in enumerate(kg.edges)}
+            terms = list(kg.edges)
+            # entities can be any hashable term here, number them
+            entities = {}
+            s = np.fromiter((entities.setdefault(x, len(entities)) for pairs in kg.edges.values() for x, _ in pairs), dtype=np.int64, count=n)
+            o = np.fromiter((entities.setdefault(y, len(entities)) for pairs in kg.edges.values() for _, y in pairs), dtype=np.int64, count=n)
+            p = np.repeat(np.fromiter(ids.values(), dtype=np.int64, count=len(ids)), [len(pairs) for pairs in kg.edges.values()])
+            stats = cls.from_triples(s, p, o)
+            stats.predicates = {terms[q]: v for q, v in stats.predicates.items()}
+            return stats
+        return cls.from_triples(s, p, o)
+
+    """statistics of triple id arrays, without duplicate triples"""
+    @classmethod
+    def from_triples(cls, s, p, o):
+        s = np.asarray(s, dtype=np.int64)
+        p = np.asarray(p, dtype=np.int64)
+        o = np.asarray(o, dtype=np.int64)
+        q = np.array(GraphStatistics.PERCENTILES)
+
+        # per predicate runs of equal subjects (objects), the run lengths are their out-degrees (in-degrees)
+        def runs(entities):
+            order = np.lexsort((entities, p))
+            ps, es = p[order], entities[order]
+            starts = np.flatnonzero(np.r_[True, (ps[1:] != ps[:-1]) | (es[1:] != es[:-1])]) if len(ps) else np.zeros(0, dtype=np.int64)
+            return ps[starts], np.diff(np.r_[starts, len(ps)])
+
+        predicates = {}
+        for k, (run_p, lengths) in ((1, runs(s)), (2, runs(o))):
+            if not len(run_p):
+                continue
+            # runs of one predicate are consecutive, sort the degrees inside each group and interpolate the percentiles like np.percentile
+            group = np.cumsum(np.r_[True, run_p[1:] != run_p[:-1]]) - 1
+            starts = np.flatnonzero(np.r_[True, run_p[1:] != run_p[:-1]])
+            counts = np.diff(np.r_[starts, len(run_p)])
+            ordered = lengths[np.lexsort((lengths, group))]
+            pos = starts[:, None] + (counts[:, None] - 1) * q[None, :] / 100
+            low = np.floor(pos).astype(np.int64)
+            high = np.ceil(pos).astype(np.int64)
+            percentiles = ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+            totals = np.add.reduceat(lengths, starts)
+            for pred, total, count, perc in zip(run_p[starts].tolist(), totals.tolist(), counts.tolist(), percentiles.tolist()):
+                entry = predicates.setdefault(pred, [total, 0, 0, [], []])
+                entry[k] = count
+                entry[k + 2] = perc
+
+        size = int(max(s.max(initial=-1), o.max(initial=-1))) + 1
+        degrees = np.bincount(s, minlength=size) + np.bincount(o, minlength=size)
+        degrees = degrees[degrees > 0]
+        return cls(predicates, np.percentile(degrees, np.arange(101)).tolist() if len(degrees) else [])
+
+    def triples(self, p):
+        return self.predicates[p][0] if p in self.predicates else 0
+
+    def subjects(self, p):
+        return self.predicates[p][1] if p in self.predicates else 0
+
+    def objects(self, p):
+        return self.predicates[p][2] if p in self.predicates else 0
+
+    """distinct subjects per triple, 1 if every subject has one object"""
+    def functionality(self, p):
+        return self.subjects(p) / self.triples(p) if self.triples(p) else 0
+
+    """distinct objects per triple, 1 if every object has one subject"""
+    def inverse_functionality(self, p):
+        return self.objects(p) / self.triples(p) if self.triples(p) else 0
+
+    def out_degree(self, p):
+        return self.triples(p) / self.subjects(p) if self.subjects(p) else 0
+
+    def in_degree(self, p):
+        return self.triples(p) / self.objects(p) if self.objects(p) else 0
+
+    """percentile q (one of PERCENTILES) of the number of objects a subject of p has"""
+    def out_percentile(self, p, q):
+        return self.predicates[p][3][GraphStatistics.PERCENTILES.index(q)] if p in self.predicates else 0
+
+    """percentile q (one of PERCENTILES) of the number of subjects an object of p has"""
+    def in_percentile(self, p, q):
+        return self.predicates[p][4][GraphStatistics.PERCENTILES.index(q)] if p in self.predicates else 0
+
+    """percentile q (0 to 100) of the entity degrees"""
+    def degree_percentile(self, q:int):
+        return self.degrees[q] if self.degrees else 0
+
+    """writes the statistics as json, predicates as terms, with a fingerprint of the graph's source file"""
+    def save(self, path:str, decode, fingerprint:dict):
+        data = {"fingerprint": fingerprint, "percentiles": list(GraphStatistics.PERCENTILES), "degrees": self.degrees,
+                "predicates": {decode(p): v for p, v in self.predicates.items()}}
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+
+    """reads statistics written by save, returns them with the stored fingerprint"""
+    @classmethod
+    def load(cls, path:str, encode):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if tuple(data["percentiles"]) != GraphStatistics.PERCENTILES:
+            return None, None
+        return cls({encode(p): v for p, v in data["predicates"].items()}, data["degrees"]), data["fingerprint"]
+
+
+
+"""
+class that holds all information on predicate mappings for a kg and specific target.
+stats -- GraphStatistics of the graph, used to order joins
+the reverse indexes of the mappings (originals, variant_index, negative_index) are built once by index(),
+P_maps of other targets made with for_target share them
+"""
 class P_map:
-    def __init__(self, target, predicates, neg_predicates, predicate_mappings, neg_predicate_mappings):
+    def __init__(self, target, predicates, neg_predicates, predicate_mappings, neg_predicate_mappings, stats:GraphStatistics=None):
         self.target = target
         self.predicates = predicates
         self.neg_predicates = neg_predicates
         self.predicate_mappings = predicate_mappings
         self.neg_predicate_mappings = neg_predicate_mappings
+        self.stats = stats
+        self.fanouts = {}
+        self.variant_sets = {}
+        self.index()
+
+    """
+    builds the reverse indexes of the mappings, needs to be called again if they change.
+        originals -- post-normalization and negative predicate -> original predicate
+        variant_index -- original predicate -> post-normalization predicates
+        negative_index -- post-normalization predicate -> negative variants
+    """
+    def index(self):
+        self.originals = {}
+        self.variant_index = {}
+        self.negative_index = {}
+        for k, v in self.neg_predicate_mappings.items():
+            self.originals[k] = self.predicate_mappings.get(v, v)
+            self.negative_index.setdefault(v, set()).add(k)
+        # a predicate in both mappings is a post-normalization predicate
+        for k, v in self.predicate_mappings.items():
+            self.originals[k] = v
+            self.variant_index.setdefault(v, set()).add(k)
+        self.fanouts = {}
+        self.variant_sets = {}
+
+    """P_map of another target over the same mappings, sharing the indexes and statistics"""
+    def for_target(self, target):
+        pmap = copy(self)
+        pmap.target = target
+        pmap.predicates = set(self.new_preds(target))
+        pmap.neg_predicates = self.neg_preds(pmap.predicates)
+        return pmap
 
     def __repr__(self) -> str:
         return f"{type(self).__name__}(target={self.target},\n\npredicates={self.predicates},\n\nneg_predicates={self.neg_predicates},\n\npredicate_mappings={self.predicate_mappings},\n\nneg_predicate_mappings={self.neg_predicate_mappings})"
@@ -110,6 +702,7 @@ class P_map:
             for np in self.neg_predicate_mappings[p]:
                 d[p1].add(addPrefix(np, prefix))
         self.neg_predicate_mappings = d
+        self.index()
 
     def removePrefix(self, prefix):
         self.target = removePrefix(self.target, prefix)
@@ -137,53 +730,125 @@ class P_map:
             for np in self.neg_predicate_mappings[p]:
                 d[p1].add(removePrefix(np, prefix))
         self.neg_predicate_mappings = d
+        self.index()
 
     """
     get a predicates predecessor, for a negative_pred get post-normalization positive predicate, for that, get original predicate
     """
     def original_pred(self, new_pred:str):
-        if new_pred in self.predicate_mappings:
-            return self.predicate_mappings[new_pred]
-        if new_pred in self.neg_predicate_mappings:
-            return self.predicate_mappings[self.neg_predicate_mappings[new_pred]]
-        if is_literal_comp(new_pred):
-            return new_pred
-        return new_pred
+        return self.originals.get(new_pred, new_pred)
 
 
     """
     get post normalization predicates from their pre-normalization predecessor
     """
     def new_preds(self, original_pred:str):
-        return {k for k, v in self.predicate_mappings.items() if v == original_pred}
-
-
-
+        return self.variant_index.get(original_pred, set())
 
     """
     get existing negative variants of post-normalization predicates
     """
     def neg_preds(self, new_preds:set):
-        return {k for k, v in self.neg_predicate_mappings.items() if v in new_preds}
+        return {k for p in new_preds for k in self.negative_index.get(p, ())}
 
+    """
+    predicates of the graph whose original predicate is original_pred, without negative predicates.
+    a predicate without mapping is its own original
+    """
+    def variants(self, original_pred):
+        v = self.variant_sets.get(original_pred)
+        if v == None:
+            v = {k for k in self.new_preds(original_pred) if k not in self.neg_predicate_mappings}
+            if original_pred not in self.originals:
+                v.add(original_pred)
+            v = frozenset(v)
+            self.variant_sets[original_pred] = v
+        return v
 
+    """
+    average number of entities reached from one entity over the post-normalization variants of original predicate p,
+    from subject to objects if outgoing, else from object to subjects. 1 if there are no statistics
+    """
+    def fanout(self, p, outgoing:bool):
+        key = (p, outgoing)
+        f = self.fanouts.get(key)
+        if f == None:
+            if self.stats == None:
+                f = 1
+            else:
+                triples = 0
+                entities = 0
+                for q in self.new_preds(p) or {p}:
+                    triples += self.stats.triples(q)
+                    entities += self.stats.subjects(q) if outgoing else self.stats.objects(q)
+                f = triples / entities if entities else 0
+            self.fanouts[key] = f
+        return f
 
 
-""" represents a path in the graph"""
+
+
+"""
+represents a path in the graph. paths are immutable, extending a path creates a new one that only holds the new atom
+and points to the path it was extended from, so paths of a search tree share their common atoms.
+a path also keeps its frontier (the entity the last atom reached, head subject for an empty path) and the entities of its atoms
+"""
 class Path:
-    def __init__(self, head=(), graph=None):
-        if graph == None:
-            graph = IncidenceList()
-        self.graph = graph
+    __slots__ = ("head", "parent", "atom", "length", "frontier", "visited")
+
+    def __init__(self, head=(), parent=None, atom=None):
         self.head = head
-        return
-    
-    
-    def copy(self):
-        return Path(self.head, self.graph.copy())
+        self.parent = parent
+        self.atom = atom
+        if parent == None:
+            self.length = 0
+            self.frontier = head[0] if head else None
+            self.visited = frozenset()
+        else:
+            self.length = parent.length + 1
+            s, _, o = atom
+            # a reflexive atom stays at the frontier
+            self.frontier = o if s == parent.frontier else s
+            self.visited = parent.visited | {s, o}
+
     def __repr__(self):
-        return f"Path with:\n head: {self.head}\n{self.graph}\n"
-        
+        return f"Path with:\n head: {self.head}\n atoms: {self.atoms()}\n"
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, triple):
+        path = self
+        while path.atom != None:
+            if path.atom == triple:
+                return True
+            path = path.parent
+        return False
+
+    """new path with triple added, O(1)"""
+    def extend(self, triple):
+        return Path(self.head, self, triple)
+
+    """atoms of the path in the order they were added"""
+    def atoms(self):
+        out = []
+        path = self
+        while path.atom != None:
+            out.append(path.atom)
+            path = path.parent
+        out.reverse()
+        return out
+
+    """entities of the path's atoms, the head is not included"""
+    def nodes(self):
+        return self.visited
+
+    """the atoms as IncidenceList, built on every access"""
+    @property
+    def graph(self):
+        graph = IncidenceList()
+        graph.add_triples(self.atoms())
+        return graph
     
 
 
@@ -193,18 +858,19 @@ class Path:
     def frontiers_rudik_old(self):
         
         h1 = self.head[0]
-        if h1 not in self.graph.nodes.keys():
+        graph = self.graph
+        if h1 not in graph.nodes.keys():
             # head subject is leaf
             return h1
 
-        for node, preds in self.graph.nodes.items():
+        for node, preds in graph.nodes.items():
             # if node has more than one predicate, it can't be a leaf
             if node == h1 or len(preds) > 1:
                 continue
 
             # node has only one predicate, count instances of it
             count = 0
-            for pair in self.graph.edges[next(p for p in preds)]:
+            for pair in graph.edges[next(p for p in preds)]:
                 if node in pair:
                     if count:
                         count += 1
@@ -214,23 +880,25 @@ class Path:
                 return node
         return None
 
+    # recomputes the frontier from the atoms, Path.frontier holds the same for rudik paths, kept for validation
     def frontiers_rudik(self):
         
         h1 = self.head[0]
-        if not self.graph.nodes or (len(self.graph.nodes) == 1 and h1 in self.graph.nodes):
+        graph = self.graph
+        if not graph.nodes or (len(graph.nodes) == 1 and h1 in graph.nodes):
             # head subject is leaf
             return h1
         
 
 
-        for node, preds in self.graph.nodes.items():
+        for node, preds in graph.nodes.items():
             # count occurences of node, 2 is too many, disregard s=o triples
             if node == h1:
                 continue
             found1 = False
             found2 = False
             for p in preds:
-                for pair in self.graph.edges[p]:
+                for pair in graph.edges[p]:
                     if node in pair:
                         if not pair[0] == pair[1]:
                         # found an occurence of node that isn't a self circle
@@ -267,7 +935,8 @@ class Path:
     
         triple_set = set()
 
-        nodes = set(self.graph.nodes.keys())
+        graph = self.graph
+        nodes = set(graph.nodes.keys())
         node = self.head[0]
 
         # collect reflexive triples, to sort in case there are multiple
@@ -281,8 +950,8 @@ class Path:
             nodes.discard(node)
             # get connecting triple(s), instantly add reflexive, then the other one and traverse it
 
-            for p in self.graph.nodes[node]:
-                for pair in self.graph.edges[p]:
+            for p in graph.nodes[node]:
+                for pair in graph.edges[p]:
                     if node in pair:
                         if pair[0] == pair[1]:
                             ref_triples.append(original_triple((node, p, node), pmap))
@@ -319,10 +988,10 @@ class Path:
                     name_dict[next_triple[2]] = {var_o}
                 triple_set.add((var_s, next_triple[1], var_o))
             else:
-                return Rule(original_triple((generate_var(97), self.head[1], generate_var(98)), pmap), triple_set, {tuple(c) for c in name_dict.values() if len(c) > 1})
+                break
             node = next_node
 
-        return Rule(original_triple((generate_var(97), self.head[1], generate_var(98)), pmap), triple_set, {tuple(c) for c in name_dict.values() if len(c) > 1})
+        return Rule(original_triple((generate_var(97), self.head[1], generate_var(98)), pmap), triple_set, {tuple(sorted(c)) for c in name_dict.values() if len(c) > 1}, min(name_dict[self.frontier])).canonical()
 
 
     def rule(self, pmap:P_map):
@@ -445,45 +1114,147 @@ class Path:
 
 
 
-""" represents a (sub)rule"""
+"""
+represents a (sub)rule, rules are immutable.
+body and connections are frozensets, the variables of a connection are sorted. key is the sorted form of the rule, 
+its hash is computed once.
+for a rule built from rudik paths, frontier is a variable of the node the paths are expanded from, 
+extensions memoizes the rules derived by extend
+"""
 class Rule:
-    def __init__(self, head=(), body=None, connections=None):
+    __slots__ = ("head", "body", "connections", "frontier", "extensions", "key", "hash")
+
+    def __init__(self, head=(), body=None, connections=None, frontier=None):
         if body == None:
-            body = set()
+            body = ()
         if connections == None:
-            connections = set()
+            connections = ()
         self.head = head
-        self.body = body
-        self.connections = connections
-
+        self.body = frozenset(body)
+        self.connections = frozenset(tuple(sorted(c)) for c in connections)
+        self.frontier = frontier
+        self.extensions = {}
+        self.key = (head, tuple(sorted(self.body)), tuple(sorted(self.connections)))
+        self.hash = hash(self.key)
 
-    def __key(self):
-        return (self.head, self.body, self.connections)
-    
     def __hash__(self):
-        return int(sha256(str(self.__key()).encode('utf-8')).hexdigest(), 16)
+        return self.hash
+
+    """extensions are a cache of derived rules, they aren't pickled"""
+    def __getstate__(self):
+        return self.head, self.body, self.connections, self.frontier, self.key
+
+    def __setstate__(self, state):
+        self.head, self.body, self.connections, self.frontier, self.key = state
+        self.extensions = {}
+        self.hash = hash(self.key)
     
     def __eq__(self, other):
         if isinstance(other, Rule):
-            return self.__key() == other.__key()
+            return self.hash == other.hash and self.key == other.key
         return
     
     def __repr__(self):
         return f"Rule:\nhead: {self.head},\nbody: {self.body},\nconnections: {self.connections}.\n"
     
-    def copy(self):
-        r = Rule()
-        r.head = self.head
-        r.body = self.body.copy()
-        r.connections = self.connections.copy()
-        return r
-
     def get_connections(self, var):
         for con in self.connections:
             if var in con:
                 return con
         return ()
 
+    """
+    rule of a path of this rule extended at its frontier by an atom with (original) predicate p, the same rule as rule_rudik of the extended path (in canonical form).
+        direction -- "out" if the atom leaves the frontier, "in" if it enters it, "self" if it is reflexive
+        closing -- the atom reaches the head object
+    """
+    def extend(self, p, direction:str, closing:bool=False):
+        key = (p, direction, closing)
+        child = self.extensions.get(key)
+        if child != None:
+            return child
+
+        count = 99 + 2 * len(self.body)
+        var_s = f"?{chr(count)}"
+        var_o = f"?{chr(count + 1)}"
+        if direction == "out":
+            near, far = (var_s,), var_o
+        elif direction == "in":
+            near, far = (var_o,), var_s
+        else:
+            near, far = (var_s, var_o), None
+
+        connections = set(self.connections)
+        frontier_vars = self.get_connections(self.frontier) or (self.frontier,)
+        connections.discard(frontier_vars)
+        connections.add(tuple(sorted(frontier_vars + near)))
+        frontier = self.frontier
+        if far != None:
+            frontier = far
+            if closing:
+                head_vars = self.get_connections(self.head[2]) or (self.head[2],)
+                connections.discard(head_vars)
+                connections.add(tuple(sorted(head_vars + (far,))))
+
+        child = Rule(self.head, self.body | {(var_s, p, var_o)}, connections, frontier).canonical()
+        self.extensions[key] = child
+        return child
+
+    """
+    the same rule with canonically named variables, rules that only differ in the naming of their variables get equal canonical forms.
+    atoms are ordered by predicate and the roles of their nodes, atoms that can't be told apart that way are tried in every order 
+    and the order giving the smallest key is used. atom i gets the variables ?c+2i and ?c+2i+1 like in rule_rudik
+    """
+    def canonical(self):
+        node = {}
+        for c in self.connections:
+            for var in c:
+                node[var] = c
+        def node_of(var):
+            return node.get(var, (var,))
+
+        head_s = node_of(self.head[0])
+        head_o = node_of(self.head[2])
+        degree = {}
+        for s, _, o in self.body:
+            degree[node_of(s)] = degree.get(node_of(s), 0) + 1
+            degree[node_of(o)] = degree.get(node_of(o), 0) + 1
+
+        def role(n):
+            if n == head_s:
+                return 0
+            if n == head_o:
+                return 1
+            return 2
+
+        groups = {}
+        for atom in self.body:
+            s, p, o = node_of(atom[0]), atom[1], node_of(atom[2])
+            groups.setdefault((p, role(s), role(o), s == o, degree[s], degree[o]), []).append(atom)
+
+        best = None
+        for order in product(*(permutations(groups[k]) for k in sorted(groups))):
+            names = {head_s: [self.head[0]]}
+            names.setdefault(head_o, []).append(self.head[2])
+            body = []
+            count = 99
+            for group in order:
+                for s, p, o in group:
+                    var_s = f"?{chr(count)}"
+                    var_o = f"?{chr(count + 1)}"
+                    count += 2
+                    names.setdefault(node_of(s), []).append(var_s)
+                    names.setdefault(node_of(o), []).append(var_o)
+                    body.append((var_s, p, var_o))
+            candidate = Rule(self.head, body, [c for c in names.values() if len(c) > 1])
+            if best == None or candidate.key < best[0].key:
+                best = (candidate, names)
+
+        candidate, names = best
+        if self.frontier != None:
+            candidate.frontier = min(names[node_of(self.frontier)])
+        return candidate
+
     
     # def as_csv_row(self, negative_rules):
     #     def triple_csv(triple, negative=False):
@@ -525,9 +1296,12 @@ class Rule:
     #         print(f"rule {self}, name dict {name_dict}")
     #         raise ValueError
         
-    def as_csv_dict(self, negative_rules):
+    def as_csv_dict(self, negative_rules, decode=None):
         def triple_tsv(triple, negative=False):
             s,p,o = triple
+            if decode:
+                # predicates of rules mined on an encoded graph are ids
+                p = decode(p)
             if negative:
                 return f"NOT({s} {p} {o})"
             return f"{s} {p} {o}"
@@ -537,7 +1311,7 @@ class Rule:
             out = {}
             name_dict = {}
             non_head_var = 99
-            for c in self.connections:
+            for c in self.key[2]:
                 # head vars are always var1 and var 2, after that, need to ensure that no var is skipped for a more intuitive output (e.g. not V1, V2, and V5 as only vars)
                 m = min(c)
                 if m >= "?c":
@@ -548,7 +1322,7 @@ class Rule:
                     name_dict[var] = m
                     
             # need to account for leaves
-            for triple in self.body:
+            for triple in self.key[1]:
                 if triple[0] not in name_dict:
                     name_dict[triple[0]] = f"?{chr(non_head_var)}"
                     non_head_var += 1
@@ -559,7 +1333,7 @@ class Rule:
                 out['Head'] = triple_tsv((name_dict[self.head[0]], self.head[1], name_dict[self.head[2]]), negative_rules)
             else:
                 out['Head'] = triple_tsv((name_dict[self.head[0]], self.head[1], name_dict[self.head[2]]))
-            out['Body'] = ("   ".join(triple_tsv((name_dict[t[0]], t[1], name_dict[t[2]])) for t in self.body))
+            out['Body'] = ("   ".join(triple_tsv((name_dict[t[0]], t[1], name_dict[t[2]])) for t in self.key[1]))
 
             return out
         except:
@@ -568,9 +1342,12 @@ class Rule:
 
 
 
-    def as_tsv_dict(self, negative_rules):
+    def as_tsv_dict(self, negative_rules, decode=None):
         def triple_tsv(triple, negative=False):
             s,p,o = triple
+            if decode:
+                # predicates of rules mined on an encoded graph are ids
+                p = decode(p)
             if negative:
                 return f"NOT{p}({s},{o})"
             return f"{p}({s},{o})"
@@ -580,7 +1357,7 @@ class Rule:
             out = {}
             name_dict = {}
             non_head_var = 3
-            for c in self.connections:
+            for c in self.key[2]:
                 # head vars are always var1 and var 2, after that, need to ensure that no var is skipped for a more intuitive output (e.g. not V1, V2, and V5 as only vars)
                 m = min(c)
                 if m >= "?VAR3":
@@ -591,7 +1368,7 @@ class Rule:
                     name_dict[var] = m
                     
             # need to account for leaves
-            for triple in self.body:
+            for triple in self.key[1]:
                 if triple[0] not in name_dict:
                     name_dict[triple[0]] = f"?VAR{non_head_var}"
                     non_head_var += 1
@@ -602,7 +1379,7 @@ class Rule:
                 out['Head'] = triple_tsv((name_dict[self.head[0]], self.head[1], name_dict[self.head[2]]), negative_rules)
             else:
                 out['Head'] = triple_tsv((name_dict[self.head[0]], self.head[1], name_dict[self.head[2]]))
-            out['Body'] = (";".join(triple_tsv((name_dict[t[0]], t[1], name_dict[t[2]])) for t in self.body))
+            out['Body'] = (";".join(triple_tsv((name_dict[t[0]], t[1], name_dict[t[2]])) for t in self.key[1]))
 
             return out
         except:
@@ -611,6 +1388,223 @@ class Rule:
     
 
 
+"""
+numbering of the examples of one target predicate, so a set of them is a bitset in a python int with bit i for example i.
+union, intersection and difference are |, & and & ~, the size is bit_count()
+"""
+class ExampleSet:
+    def __init__(self, examples):
+        self.examples = sorted(set(examples))
+        self.index = {ex: i for i, ex in enumerate(self.examples)}
+        self.all = (1 << len(self.examples)) - 1
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.examples)} examples)"
+
+    def __len__(self):
+        return len(self.examples)
+
+    """bitset of examples, all of them need to be numbered"""
+    def bits(self, examples):
+        index = self.index
+        b = 0
+        for ex in examples:
+            b |= 1 << index[ex]
+        return b
+
+    """examples in bitset b"""
+    def members(self, b:int):
+        examples = self.examples
+        out = []
+        while b:
+            low = b & -b
+            out.append(examples[low.bit_length() - 1])
+            b ^= low
+        return out
+
+
+
+"""
+coverage of rules over the examples of one target predicate, whether a rule covers an example doesn't change while mining.
+    examples -- numbering of the examples, tested and covered are bitsets over it
+    tested -- rule -> examples the rule was evaluated on
+    covered -- rule -> the tested examples the rule covers
+    unbound -- rule -> its unbound rule
+    heads -- rule -> (its paths, their number, cov_g), paths are only added to a rule so cov_g is current while the number is.
+             entries are dropped (see drop) when a rule leaves rule_dict
+"""
+class CoverageCache:
+    def __init__(self, examples:ExampleSet):
+        self.examples = examples
+        self.tested = {}
+        self.covered = {}
+        self.unbound = {}
+        self.heads = {}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.tested)} rules)"
+
+    """rule left rule_dict, its paths aren't needed anymore"""
+    def drop(self, rule):
+        self.heads.pop(rule, None)
+
+
+
+"""
+coverage of R_out as bitsets, accepting a rule adds its coverage
+    cov_g -- cov_g of R_out
+    cov_v -- coverage of R_out over v
+    uncov_v -- unbound coverage of R_out over v
+"""
+class RuleListCoverage:
+    def __init__(self):
+        self.cov_g = 0
+        self.cov_v = 0
+        self.uncov_v = 0
+
+    def __repr__(self):
+        return f"{type(self).__name__}(cov_g={self.cov_g.bit_count()}, cov_v={self.cov_v.bit_count()}, uncov_v={self.uncov_v.bit_count()})"
+
+    """adds the coverage of an accepted rule"""
+    def add(self, cov_g:int, cov_v:int, uncov_v:int):
+        self.cov_g |= cov_g
+        self.cov_v |= cov_v
+        self.uncov_v |= uncov_v
+
+
+
+"""
+priority queue over the rules of rule_dict by weight, for find_r. entries are (key, fresh, valid rank, tiebreak, order, generation, rule).
+the key of a fresh entry is the weight of the rule for the current R_out, the key of a stale entry is a lower bound of it:
+the alpha part, computed when the rule is added or R_out changed, plus a lower bound of the beta part.
+a stale entry is popped before fresh entries of the same key and gets its weight then, so the first fresh entry popped
+has the least weight and rules whose bound can't beat it are never evaluated.
+among rules of equal weight the valid rule added last wins, else the invalid rule added first, the same choice a scan over rule_dict makes.
+    order -- rule -> number of its last insertion into rule_dict, entries of earlier insertions are dropped
+    alphas -- rule -> alpha part of its weight for the current R_out
+    spreads -- rule -> upper bound of the number of examples it adds to the unbound coverage of R_out, see est_m_beta
+    generation -- number of changes of R_out
+"""
+class RuleQueue:
+    def __init__(self):
+        self.heap = []
+        self.order = {}
+        self.alphas = {}
+        self.spreads = {}
+        self.count = 0
+        self.generation = 0
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self.heap)} entries, generation {self.generation})"
+
+    def __len__(self):
+        return len(self.heap)
+
+    """adds a rule that was (re)inserted into rule_dict with the lower bound of its weight"""
+    def add(self, rule, key:float):
+        self.count += 1
+        self.order[rule] = self.count
+        heapq.heappush(self.heap, (key, 0, 0, self.count, self.count, -1, rule))
+
+    """fresh entry of rule with its weight for the current R_out"""
+    def push(self, rule, weight:float, valid:bool):
+        order = self.order[rule]
+        heapq.heappush(self.heap, (weight, 1, 0 if valid else 1, -order if valid else order, order, self.generation, rule))
+
+    """R_out changed, keys -- rule -> lower bound of its new weight for every rule of rule_dict"""
+    def invalidate(self, keys:dict):
+        self.generation += 1
+        heap = []
+        for rule, key in keys.items():
+            order = self.order[rule]
+            heap.append((key, 0, 0, order, order, -1, rule))
+        heapq.heapify(heap)
+        self.heap = heap
+
+    """
+    pops the entry with the least key whose rule is still in rule_dict.
+    returns (rule, key, fresh) or None if there is no such entry
+    """
+    def pop(self, rule_dict:dict):
+        while self.heap:
+            key, _, _, _, order, generation, rule = heapq.heappop(self.heap)
+            if rule in rule_dict and self.order[rule] == order:
+                return rule, key, generation == self.generation
+        return None
+
+    """
+    pops the stale entries that follow, up to n of them, and returns their rules. stops at the first fresh entry.
+    evaluating them ahead of time only replaces bounds by weights, the rule find_r picks stays the same
+    """
+    def pop_stale(self, rule_dict:dict, n:int):
+        rules = []
+        while self.heap and len(rules) < n:
+            _, _, _, _, order, generation, rule = self.heap[0]
+            if rule in rule_dict and self.order[rule] == order:
+                if generation == self.generation:
+                    break
+                rules.append(rule)
+            heapq.heappop(self.heap)
+        return rules
+
+
+
+"""
+appends mined rules (dicts of as_csv_dict) to the rules csv and optionally to a jsonl file, one json object per line.
+writes are buffered, the rules of a target are flushed and synced to disk together, so a crash only loses the target being mined
+"""
+class RuleWriter:
+    fieldnames = ['Body', 'Head']
+
+    def __init__(self, rules_file:str, jsonl_file:str=None, buffering:int=1 << 20):
+        self.rules_file = rules_file
+        self.jsonl_file = jsonl_file
+        self.count = 0
+        self.file = open(rules_file, mode='w', newline='', encoding='utf-8', buffering=buffering)
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+        self.writer.writeheader()
+        self.jsonl = None
+        if jsonl_file != None:
+            self.jsonl = open(jsonl_file, mode='w', encoding='utf-8', buffering=buffering)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.rules_file}, {self.count} rules)"
+
+    """appends the rules of one target and syncs them to disk"""
+    def write(self, rules:list):
+        self.writer.writerows(rules)
+        files = [self.file]
+        if self.jsonl != None:
+            self.jsonl.writelines(json.dumps(rule, ensure_ascii=False) + "\n" for rule in rules)
+            files.append(self.jsonl)
+        for file in files:
+            file.flush()
+            os.fsync(file.fileno())
+        self.count += len(rules)
+
+    def close(self):
+        self.file.close()
+        if self.jsonl != None:
+            self.jsonl.close()
+
+    """rewrites the closed files with the rules sorted by head and body, for an output that doesn't depend on the order of the targets"""
+    def sort(self):
+        with open(self.rules_file, mode='r', newline='', encoding='utf-8') as file:
+            rows = sorted(csv.DictReader(file), key=lambda row: (row['Head'], row['Body']))
+        with open(self.rules_file + ".tmp", mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=self.fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(self.rules_file + ".tmp", self.rules_file)
+        if self.jsonl_file != None:
+            with open(self.jsonl_file, mode='r', encoding='utf-8') as file:
+                rules = sorted((json.loads(line) for line in file), key=lambda rule: (rule['Head'], rule['Body']))
+            with open(self.jsonl_file + ".tmp", mode='w', encoding='utf-8') as file:
+                file.writelines(json.dumps(rule, ensure_ascii=False) + "\n" for rule in rules)
+            os.replace(self.jsonl_file + ".tmp", self.jsonl_file)
+
+
+
 """represents information from an ontology.
    namely the class hierarchy and domain and range for properties."""
 class Ontology:
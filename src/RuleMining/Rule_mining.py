@@ -1,16 +1,19 @@
 import json
-import csv
+import random
+import multiprocessing
 import numpy as np
 import warnings
 from RuleMining.Util import *
-from RuleMining.Classes import Path, Rule, P_map, IncidenceList, Ontology
+from RuleMining.Classes import Path, Rule, P_map, IncidenceList, EncodedIncidenceList, FrozenGraph, GraphStatistics, Ontology, CoverageCache, ExampleSet, RuleListCoverage, RuleQueue, RuleWriter
+from itertools import islice
 
 
 
 
 
 def mine_rules(transformed_kg:IncidenceList, targets:set, transform_output_dir:str, ontology:Ontology, rules_file:str, prefix:str, max_depth:int=3, set_size:int=100, 
-               alpha:float=0.5, type_predicate:str='http://www.w3.org/1999/02/22-rdf-syntax-ns#type', rule_type:str="rudik", negative_rules:bool=False, onto_valid:bool=False):
+               alpha:float=0.5, type_predicate:str='http://www.w3.org/1999/02/22-rdf-syntax-ns#type', rule_type:str="rudik", negative_rules:bool=False, onto_valid:bool=False, freeze:bool=True,
+               stats:GraphStatistics=None, hub_percentile:int=None, workers:int=1, target_workers:int=1, jsonl_file:str=None, sort_rules:bool=False):
     """
     Mines rules for all original predicates of a normalized knowledge graph.
     
@@ -25,14 +28,24 @@ def mine_rules(transformed_kg:IncidenceList, targets:set, transform_output_dir:s
         prefix -- prefix
         max_depth -- max length of paths in graph corresponding to rule length
         set_size -- number of elements in G and V
+        freeze -- mine on a read-only FrozenGraph (only for an EncodedIncidenceList)
+        stats -- GraphStatistics of transformed_kg (see load_statistics), computed here if not given or if the graph is filtered by onto_valid
+        hub_percentile -- paths are not expanded from entities whose degree is above this percentile (0-100) of all entity degrees, None for no limit
+        workers -- number of processes mining targets in parallel (needs the fork start method). targets are mined in sorted order with one seed each,
+                   so the examples of a target and the order of the written rules are the same for any number of workers
+        target_workers -- number of processes sharing the work on a single target, only used if workers is 1. the rules are the same as mined by one process
+        jsonl_file -- path of a .jsonl file the rules are written to as well, one json object per rule
+        sort_rules -- sort the written rules by head and body once all targets are mined
 
     Returns:
         no return
-        (but: produces a .csv file containing the mined rules)
+        (but: produces a .csv file containing the mined rules, the rules of each target are appended as soon as it is mined)
     """
 
     if alpha > 1 or alpha < 0:
         raise ValueError("alpha must be in [0,1].")
+    if hub_percentile != None and (hub_percentile > 100 or hub_percentile < 0):
+        raise ValueError("hub_percentile must be in [0,100].")
     beta = 1 - alpha
     print(f"computed beta as {beta}.\n")
     print(f"using <{type_predicate}> as type predicate.\n")
@@ -60,18 +73,23 @@ def mine_rules(transformed_kg:IncidenceList, targets:set, transform_output_dir:s
     with open(f"{transform_output_dir}/no_predicate_mappings.json", "r", encoding="utf-8") as np_map_file:
         neg_predicate_mappings = json.load(np_map_file)
 
+    # mappings and type predicate need to be in the same form as the graph (ids for an EncodedIncidenceList), terms are only used for output
+    predicate_mappings = {transformed_kg.encode(k): transformed_kg.encode(v) for k, v in predicate_mappings.items()}
+    neg_predicate_mappings = {transformed_kg.encode(k): transformed_kg.encode(v) for k, v in neg_predicate_mappings.items()}
+    type_pred = transformed_kg.encode(type_predicate)
+
     if onto_valid:
         pmap = P_map(None, None , set() , predicate_mappings, neg_predicate_mappings)
-        kg = IncidenceList()
+        kg = transformed_kg.empty()
         count = 0
-        for k,v in transformed_kg.edges.items():
-            for pair in v:
-                if k.__contains__(type_predicate):
+        for k in transformed_kg.predicates():
+            for pair in transformed_kg.pairs(k):
+                if transformed_kg.decode(k).__contains__(type_predicate):
                     kg.add(pair[0], k, pair[1])
                     continue
     
-                if fits_domain_range(pair[0], (pair[0], k, pair[1]), ontology, transformed_kg, pmap, type_predicate):
-                    if fits_domain_range(pair[1], (pair[0], k, pair[1]), ontology, transformed_kg, pmap, type_predicate):
+                if fits_domain_range(pair[0], (pair[0], k, pair[1]), ontology, transformed_kg, pmap, type_pred):
+                    if fits_domain_range(pair[1], (pair[0], k, pair[1]), ontology, transformed_kg, pmap, type_pred):
                         count += 1
                         kg.add(pair[0], k, pair[1])
         transformed_kg = kg
@@ -91,103 +109,192 @@ def mine_rules(transformed_kg:IncidenceList, targets:set, transform_output_dir:s
     # need to ensure predicate mapping consistency, every new predicate mentioned in mappings must be in kg, even if there is no corresponding triple
     check_preds_in_graph(neg_predicate_mappings, transformed_kg)
 
-    result = []
-    for p in targets:
-        # getting post normalization instances of target predicate and the negative instances from validation
-        pmap = P_map(p, new_preds(p, predicate_mappings), set() , predicate_mappings, neg_predicate_mappings)
-        pmap.neg_predicates = neg_preds(pmap.predicates, neg_predicate_mappings)
-
-        # instances = sum(len(transformed_kg.edges[e]) for e in pmap.new_preds(p))
-        # set_size_p = min(max(set_size, int(instances * 0.1)), 100)
-        set_size_p = set_size
-        if negative_rules:
-            # TODO prepare g and v flipped
-            # meaning, pos examples without predicate as v, negative examples with negative predicate as g
-            pass
-            print(f"creating input sets G and V in order to mine negative rules for target predicate <{p}>...\n")
-
-            v_temp = getExamples(transformed_kg, pmap.predicates, set_size_p, ontology, pmap, type_predicate)
-            len_v = len(v_temp)
-            if len_v < set_size_p:
-                print(f"There aren't enough positive examples in the graph, proceeding with {len_v} examples in V.\n")  
-            v = set()
-            for ex in v_temp:
-                v.add((ex[0], ex[2]))
-
-
-            # first, get constraint violating triples
-            g_temp = getNegExamples(transformed_kg, pmap.neg_predicates, set_size_p)
-
-            # if not enough in v fill with lcwa-conform examples
-            len_g = len(g_temp)
-            if len_g < set_size_p:
-                print(f"{len_g} examples found from constraint violations, selecting remaining {set_size_p - len_g} examples from graph for G.\n")
-                g_temp.update(getExamplesLCWA(transformed_kg, ontology, pmap, set_size_p - len_g, type_predicate))
-
-            # if not enough in v fill with random examples
-            len_g = len(g_temp)
-            if len_g < set_size_p:
-                print(f"There aren't enough negative examples in the graph, choosing {set_size_p - len_g} random examples for G.\n")  
-                v.update(getRandomNegExamples(transformed_kg, pmap.predicates, set_size_p - len_g, g_temp)) 
-
-
-            len_g = len(g_temp)
-            if len_g < set_size_p:
-                print(f"There aren't enough negative examples in the graph, proceeding with {len_g} examples for G.\n")   
-
-            g = set()
-            for ex in g_temp:
-                g.add((ex[0], pmap.target, ex[1]))
-        else:
-            print(f"creating input sets G and V for target predicate <{p}>...\n")
-            # create positive examples
-            g = getExamples(transformed_kg, pmap.predicates, set_size_p, ontology, pmap, type_predicate)
-            len_g = len(g)
-            if len_g < set_size_p:
-                print(f"There aren't enough positive examples in the graph, proceeding with {len_g} examples.\n")  
-
-            # first, get constraint violating triples
-            v = getNegExamples(transformed_kg, pmap.neg_predicates, set_size_p)
-
-            # if not enough in v fill with lcwa-conform examples
-            len_v = len(v)
-            if len_v < set_size_p:
-                print(f"{len_v} examples found from constraint violations, selecting remaining {set_size_p - len_v} examples from graph.\n")
-                v.update(getExamplesLCWA(transformed_kg, ontology, pmap, set_size_p - len_v, type_predicate))
-
-            # if not enough in v fill with random examples
-            len_v = len(v)
-            if len_v < set_size_p:
-                print(f"There aren't enough negative examples in the graph, choosing {set_size_p - len_v} random examples.\n")  
-                v.update(getRandomNegExamples(transformed_kg, pmap.predicates, set_size_p - len_v, v)) 
-
-
-            len_v = len(v)
-            if len_v < set_size_p:
-                print(f"There aren't enough negative examples in the graph, proceeding with {len_v} examples.\n")   
-
-            if not g:
-                warnings.warn(f"There are no generation examples for {pmap.target}. No rule-mining possible \n", UserWarning)   
-                continue  
-            if not v:
-                warnings.warn(f"There are no validation examples for {pmap.target}. No rule-mining possible \n", UserWarning)   
-                continue
-
-        print(f"mining rules for target predicate <{p}>...\n")
-
-        result.extend(mine_rules_for_target_predicate(g, v, pmap, transformed_kg, type_predicate, ontology, expand_fun, fits_max_depth, negative_rules, max_depth, alpha, beta, onto_valid))
-        
-    print(result)
-    #TODO add result to csvs
-    with open(rules_file, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=['Body', 'Head'])
-        writer.writeheader()
-        writer.writerows(result)
+    # the graph is not modified during mining
+    if freeze and isinstance(transformed_kg, EncodedIncidenceList):
+        transformed_kg = FrozenGraph.from_incidence_list(transformed_kg)
+
+    # computed once, orders the joins of the coverage checks
+    if stats == None or onto_valid:
+        stats = GraphStatistics.from_graph(transformed_kg)
+    if hub_percentile != None:
+        stats.hub_degree = stats.degree_percentile(hub_percentile)
+
+    # reverse indexes of the mappings, built once for all targets
+    mappings = P_map(None, set(), set(), predicate_mappings, neg_predicate_mappings, stats)
+
+    writer = RuleWriter(rules_file, jsonl_file)
+    if (workers > 1 or target_workers > 1) and "fork" not in multiprocessing.get_all_start_methods():
+        warnings.warn("mining in parallel needs the fork start method, mining sequentially.\n", UserWarning)
+        workers = target_workers = 1
+    # targets are mined in sorted order, the order of a set of strings changes from run to run.
+    # one seed per target, drawn in this order. the examples of a target only depend on its seed,
+    # not on the targets mined before it or on which worker mines it, so both modes sample the same examples
+    jobs = [(p, random.getrandbits(64)) for p in sorted(targets)]
+    if workers <= 1:
+        try:
+            for p, seed in jobs:
+                random.seed(seed)
+                rules = mine_target(p, transformed_kg, mappings, ontology, type_pred, expand_fun, fits_max_depth, negative_rules, set_size, max_depth, alpha, beta, onto_valid, target_workers)
+                writer.write(rules)
+                print(f"wrote {len(rules)} rules for target predicate <{p}>.\n")
+        finally:
+            writer.close()
+    else:
+        # the workers are forked, they share the graph copy-on-write instead of getting it pickled
+        global _forked
+        _forked = (transformed_kg, mappings, ontology, type_pred, expand_fun, fits_max_depth, negative_rules, set_size, max_depth, alpha, beta, onto_valid)
+        # build the lazy pair index before forking, so the workers share it too
+        transformed_kg.pair_predicates(0, 0)
+        try:
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                # imap keeps the order of targets
+                for (p, _), rules in zip(jobs, pool.imap(mine_target_forked, jobs)):
+                    writer.write(rules)
+                    print(f"wrote {len(rules)} rules for target predicate <{p}>.\n")
+        finally:
+            _forked = None
+            writer.close()
+
+    print(f"{writer.count} rules written to {rules_file}.\n")
+    if sort_rules:
+        writer.sort()
 
     return
 
+"""
+creates G and V for the original predicate p and mines its rules, returns the rules as dicts for the csv
+"""
+def mine_target(p, transformed_kg:IncidenceList, mappings:P_map, ontology:Ontology, type_pred, expand_fun, fits_max_depth, negative_rules:bool, 
+                set_size:int, max_depth:int, alpha:float, beta:float, onto_valid:bool, workers:int=1):
+    # getting post normalization instances of target predicate and the negative instances from validation
+    target = transformed_kg.encode(p)
+    pmap = mappings.for_target(target)
+
+    # instances = sum(len(transformed_kg.edges[e]) for e in pmap.new_preds(p))
+    # set_size_p = min(max(set_size, int(instances * 0.1)), 100)
+    set_size_p = set_size
+    if negative_rules:
+        # TODO prepare g and v flipped
+        # meaning, pos examples without predicate as v, negative examples with negative predicate as g
+        pass
+        print(f"creating input sets G and V in order to mine negative rules for target predicate <{p}>...\n")
+
+        v_temp = getExamples(transformed_kg, pmap.predicates, set_size_p, ontology, pmap, type_pred)
+        len_v = len(v_temp)
+        if len_v < set_size_p:
+            print(f"There aren't enough positive examples in the graph, proceeding with {len_v} examples in V.\n")  
+        v = set()
+        for ex in v_temp:
+            v.add((ex[0], ex[2]))
+
+
+        # first, get constraint violating triples
+        g_temp = getNegExamples(transformed_kg, pmap.neg_predicates, set_size_p)
+
+        # if not enough in v fill with lcwa-conform examples
+        len_g = len(g_temp)
+        if len_g < set_size_p:
+            print(f"{len_g} examples found from constraint violations, selecting remaining {set_size_p - len_g} examples from graph for G.\n")
+            g_temp.update(getExamplesLCWA(transformed_kg, ontology, pmap, set_size_p - len_g, type_pred))
+
+        # if not enough in v fill with random examples
+        len_g = len(g_temp)
+        if len_g < set_size_p:
+            print(f"There aren't enough negative examples in the graph, choosing {set_size_p - len_g} random examples for G.\n")  
+            v.update(getRandomNegExamples(transformed_kg, pmap.predicates, set_size_p - len_g, g_temp)) 
+
+
+        len_g = len(g_temp)
+        if len_g < set_size_p:
+            print(f"There aren't enough negative examples in the graph, proceeding with {len_g} examples for G.\n")   
+
+        g = set()
+        for ex in g_temp:
+            g.add((ex[0], pmap.target, ex[1]))
+    else:
+        print(f"creating input sets G and V for target predicate <{p}>...\n")
+        # create positive examples
+        g = getExamples(transformed_kg, pmap.predicates, set_size_p, ontology, pmap, type_pred)
+        len_g = len(g)
+        if len_g < set_size_p:
+            print(f"There aren't enough positive examples in the graph, proceeding with {len_g} examples.\n")  
+
+        # first, get constraint violating triples
+        v = getNegExamples(transformed_kg, pmap.neg_predicates, set_size_p)
+
+        # if not enough in v fill with lcwa-conform examples
+        len_v = len(v)
+        if len_v < set_size_p:
+            print(f"{len_v} examples found from constraint violations, selecting remaining {set_size_p - len_v} examples from graph.\n")
+            v.update(getExamplesLCWA(transformed_kg, ontology, pmap, set_size_p - len_v, type_pred))
+
+        # if not enough in v fill with random examples
+        len_v = len(v)
+        if len_v < set_size_p:
+            print(f"There aren't enough negative examples in the graph, choosing {set_size_p - len_v} random examples.\n")  
+            v.update(getRandomNegExamples(transformed_kg, pmap.predicates, set_size_p - len_v, v)) 
+
+
+        len_v = len(v)
+        if len_v < set_size_p:
+            print(f"There aren't enough negative examples in the graph, proceeding with {len_v} examples.\n")   
+
+        if not g:
+            warnings.warn(f"There are no generation examples for {p}. No rule-mining possible \n", UserWarning)   
+            return []  
+        if not v:
+            warnings.warn(f"There are no validation examples for {p}. No rule-mining possible \n", UserWarning)   
+            return []
+
+    print(f"mining rules for target predicate <{p}>...\n")
+
+    if workers <= 1:
+        return mine_rules_for_target_predicate(g, v, pmap, transformed_kg, type_pred, ontology, expand_fun, fits_max_depth, negative_rules, max_depth, alpha, beta, onto_valid)
+
+    # forked workers get read-only copies of the graph and the examples, every worker keeps its own coverage cache
+    global _scoring
+    _scoring = (transformed_kg, ontology, pmap, type_pred, expand_fun, onto_valid, ExampleSet(v).all, beta, CoverageCache(ExampleSet(v)))
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            return mine_rules_for_target_predicate(g, v, pmap, transformed_kg, type_pred, ontology, expand_fun, fits_max_depth, negative_rules, max_depth, alpha, beta, onto_valid, pool, workers)
+    finally:
+        _scoring = None
+
+
+# arguments of mine_target shared with forked workers, set by mine_rules while its pool runs
+_forked = None
+
+"""mine_target in a forked worker of mine_rules, job is the target and the seed for its examples"""
+def mine_target_forked(job):
+    p, seed = job
+    random.seed(seed)
+    return mine_target(p, *_forked)
+
+
+# graph, examples and settings of the target mined by mine_target with workers, read by the forked workers
+_scoring = None
+
+"""expands the root paths in a forked worker of mine_target, returns the rule_dict of their expansions"""
+def expand_forked(paths):
+    kg, ontology, pmap, type_predicate, expand_fun, onto_safe, _, _, _ = _scoring
+    rule_dict = {}
+    roots = {}
+    for path in paths:
+        root = path.rule_rudik(pmap)
+        root = roots.setdefault(root, root)
+        expand_fun(rule_dict, path, root, kg, ontology, pmap, type_predicate, onto_safe)
+    return rule_dict
+
+"""est_m_beta of rules in a forked worker of mine_target, for R_out with the coverage cov_v and unbound coverage uncov_v"""
+def score_forked(job):
+    cov_v, uncov_v, rules = job
+    kg, _, pmap, _, _, _, v, beta, cache = _scoring
+    R_out_coverage = RuleListCoverage()
+    R_out_coverage.add(0, cov_v, uncov_v)
+    return [est_m_beta(rule, kg, v, beta, pmap, R_out_coverage, cache) for rule in rules]
+
 def mine_rules_for_target_predicate(g:set, v:set, pmap:P_map, kg:IncidenceList, type_predicate:str, ontology:Ontology, 
-                                    expand_fun, fits_max_depth, negative_rules,  max_depth:int=3, alpha:float=0.5, beta:float=0.5, onto_safe:bool=False):
+                                    expand_fun, fits_max_depth, negative_rules,  max_depth:int=3, alpha:float=0.5, beta:float=0.5, onto_safe:bool=False, pool=None, workers:int=1):
     
     """
     Args:
@@ -200,6 +307,8 @@ def mine_rules_for_target_predicate(g:set, v:set, pmap:P_map, kg:IncidenceList,
         ontology_path -- path to given ontology
         prefix -- prefix
         max_depth -- max length of paths in graph corresponding to rule length
+        pool -- pool of workers forked by mine_target, expands the root paths and evaluates the weights of the rules in batches
+        workers -- number of processes of pool
 
     Returns:
         R_out -- mined rules for the target predicate
@@ -298,24 +407,59 @@ def mine_rules_for_target_predicate(g:set, v:set, pmap:P_map, kg:IncidenceList,
     # create a path per pair in g
     # expand by one and save resulting paths in rule dict
 
+    # rule -> its paths. the paths are kept in a dict used as ordered set: paths hash by identity, so the order of a set
+    # would depend on memory addresses, and the order paths are expanded in decides the order of new rules and ties between them
     R_out_dict = {}
     rule_dict = {}  
 
-    # for saving calculation results for est m weight
-    rule_weight_dict = {}
-    R_out_cov_v_cardinality = [None]
-    R_out_uncov_v = None
+    # rules of rule_dict by weight, weights are only computed for rules whose bound beats the best weight
+    queue = RuleQueue()
+
+    # examples are numbered once, coverages are bitsets over them
+    examples_g = ExampleSet((s, o) for s, _, o in g)
+    examples_v = ExampleSet(v)
+    v_bits = examples_v.all
+
+    # coverage of R_out, updated with the coverage of every accepted rule
+    R_out_coverage = RuleListCoverage()
+
+    # coverage of every rule over v is only evaluated once per example
+    cache = CoverageCache(examples_v)
+
+    # lower bound of the weight of rule, the spread of a new rule is the one of the rule it was expanded from
+    def bound(rule, spread=None):
+        if spread != None:
+            queue.spreads[rule] = min(queue.spreads.get(rule, spread), spread)
+        queue.alphas[rule] = est_m_alpha(rule, rule_dict, R_out_dict, g, alpha, R_out_coverage, examples_g, cache)
+        return queue.alphas[rule] + est_m_beta_bound(v_bits, beta, R_out_coverage, queue.spreads.get(rule))
     
   
-    paths = {Path((s, p , o), IncidenceList()) for s,p,o in g}
+    paths = [Path((s, p , o)) for s,p,o in g]
 
     # TODO call expand rule here, duplicate code
 
-    for path in paths:
-        expand_fun(rule_dict, path, kg, ontology, pmap, type_predicate, onto_safe)
-
-
-    r, min_weight = find_r(R_out_dict, R_out_cov_v_cardinality, R_out_uncov_v, rule_dict, rule_weight_dict, kg, g, v, alpha, beta, pmap, fits_max_depth, max_depth)
+    # one rule object per distinct head, so the rules derived from it are shared by all paths
+    if pool == None:
+        roots = {}
+        for path in paths:
+            root = path.rule_rudik(pmap)
+            root = roots.setdefault(root, root)
+            expand_fun(rule_dict, path, root, kg, ontology, pmap, type_predicate, onto_safe)
+    else:
+        # the workers expand consecutive chunks of the paths. merged in order, the rules and the paths of every rule
+        # are inserted in the same order as above
+        size = -(-len(paths) // (workers * 4))
+        for expanded in pool.imap(expand_forked, [paths[i:i + size] for i in range(0, len(paths), size)]):
+            for rule, rule_paths in expanded.items():
+                if rule in rule_dict:
+                    rule_dict[rule].update(rule_paths)
+                else:
+                    rule_dict[rule] = rule_paths
+    for rule in rule_dict:
+        queue.add(rule, bound(rule))
+
+
+    r, min_weight = find_r(queue, R_out_coverage, rule_dict, kg, v_bits, beta, pmap, fits_max_depth, max_depth, cache, pool, workers)
  
 
     # main loop 
@@ -325,7 +469,7 @@ def mine_rules_for_target_predicate(g:set, v:set, pmap:P_map, kg:IncidenceList,
 
 
         # if not rule_dict or cov_g(list(R_out_dict.keys()), rule_dict, R_out_dict) == g or min_weight >= 0:
-        if not rule_dict or len(cov_g(list(R_out_dict.keys()), rule_dict, R_out_dict))/len(g) == 1 or min_weight >= 0:
+        if not rule_dict or R_out_coverage.cov_g.bit_count()/len(g) == 1 or min_weight >= 0:
         
             break
         
@@ -333,126 +477,147 @@ def mine_rules_for_target_predicate(g:set, v:set, pmap:P_map, kg:IncidenceList,
             # move rule to output dict
             R_out_dict[r] = rule_dict.pop(r)
 
-            # resetting these, since R_out has changed
-            rule_weight_dict = {}
-            R_out_cov_v_cardinality = [None, None]
-            R_out_uncov_v = None
-            print(f"\n\nFOUND RULE {r} with {min_weight}\n\n")
+            # R_out has changed
+            R_out_coverage.add(*accepted_coverage(r, rule_dict, R_out_dict, kg, v_bits, pmap, examples_g, cache))
+            cache.drop(r)
+            queue.invalidate({rule: bound(rule) for rule in rule_dict})
+            print(f"\n\nFOUND RULE {r.as_csv_dict(negative_rules, kg.decode)} with {min_weight}\n\n")
             
         else:
             # expand
             if fits_max_depth(r, max_depth):
-                expand_rule(r, rule_dict, kg, ontology, pmap, type_predicate, expand_fun, onto_safe)
+                size = len(rule_dict)
+                # if r adds nothing to the unbound coverage of R_out, neither do its expansions. their paths with a head
+                # R_out covers can't lower their weight, so these paths aren't expanded
+                spread = queue.spreads.get(r)
+                covered = set(examples_g.members(R_out_coverage.cov_g)) if spread == 0 else None
+                expand_rule(r, rule_dict, kg, ontology, pmap, type_predicate, expand_fun, onto_safe, covered)
+                # expanding only inserts, the new rules are at the end of rule_dict
+                for rule in reversed(list(islice(reversed(rule_dict), len(rule_dict) - size))):
+                    queue.add(rule, bound(rule, spread))
             # remove handled rule
             rule_dict.pop(r)
+            cache.drop(r)
 
         # find next r
-        r, min_weight = find_r(R_out_dict, R_out_cov_v_cardinality, R_out_uncov_v, rule_dict, rule_weight_dict, kg, g, v, alpha, beta, pmap, fits_max_depth, max_depth)
+        r, min_weight = find_r(queue, R_out_coverage, rule_dict, kg, v_bits, beta, pmap, fits_max_depth, max_depth, cache, pool, workers)
 
     # TODO possibly return the whole R_out_dict or calc some metrics here 
 
     
 
-    return list(rule.as_csv_dict(negative_rules) for rule in R_out_dict.keys())
-
-
+    # back to terms for the output
+    return list(rule.as_csv_dict(negative_rules, kg.decode) for rule in R_out_dict.keys())
 
-def find_r(R_out_dict:dict, R_out_cov_v_cardinality:list, R_out_uncov_v:set, rule_dict:dict, rule_weight_dict:dict, kg:IncidenceList, g:set, v:set, alpha:float, beta:float, pmap:P_map, fits_max_depth,  max_depth:int):
 
-    min_weight = np.inf
-    r = None
 
-    rules_to_remove = set()
+"""
+rule of rule_dict with the least weight, popped from queue. stale entries get their weight until the least entry is fresh,
+only the beta part needs the coverage of the rule, the alpha part is kept in queue
+"""
+def find_r(queue:RuleQueue, R_out_coverage:RuleListCoverage, rule_dict:dict, kg:IncidenceList, v:int, beta:float, pmap:P_map, fits_max_depth,  max_depth:int, cache:CoverageCache=None,
+           pool=None, workers:int=1):
 
-    for rule in rule_dict.keys():
-        if rule in rule_weight_dict:
-            weight = rule_weight_dict[rule]
-        else:
-            weight = est_m_weight(rule, R_out_dict, rule_dict, kg, g, v, alpha, beta, pmap, R_out_cov_v_cardinality, R_out_uncov_v)
-            rule_weight_dict[rule] = weight
+    while True:
+        entry = queue.pop(rule_dict)
+        if entry == None:
+            return None, np.inf
+        rule, weight, fresh = entry
+
+        if not fresh:
+            rules = [rule]
+            # with workers, the stale entries that follow are evaluated along with it, while R_out is empty est_m_beta is trivial
+            if pool != None and R_out_coverage.cov_v:
+                rules.extend(queue.pop_stale(rule_dict, workers * 8 - 1))
+            for rule, (beta_part, spread) in zip(rules, score_rules(rules, kg, v, beta, pmap, R_out_coverage, cache, pool, workers)):
+                if spread != None:
+                    queue.spreads[rule] = spread
+                queue.push(rule, queue.alphas[rule] + beta_part, is_valid(rule))
+            continue
 
         if not fits_max_depth(rule, max_depth) and (weight >= 0 or not is_valid(rule)):
-            # collect hopeless rules
-            rules_to_remove.add(rule)
+            # hopeless rule, declutter rule_dict
+            rule_dict.pop(rule)
+            cache.drop(rule)
             continue
 
-        if weight < min_weight or (weight == min_weight and is_valid(rule)):
-            r = rule
-            min_weight = weight
+        return rule, weight
 
-    # remove hopeless rules, declutter rule_dict
-    for rule in rules_to_remove:
-        rule_dict.pop(rule)
 
-    return r, min_weight
 
+"""est_m_beta of every rule of rules, split in batches across the workers of pool if there is one"""
+def score_rules(rules:list, kg:IncidenceList, v:int, beta:float, pmap:P_map, R_out_coverage:RuleListCoverage, cache:CoverageCache, pool=None, workers:int=1):
+    if pool == None or len(rules) == 1:
+        return [est_m_beta(rule, kg, v, beta, pmap, R_out_coverage, cache) for rule in rules]
+    size = -(-len(rules) // workers)
+    jobs = [(R_out_coverage.cov_v, R_out_coverage.uncov_v, rules[i:i + size]) for i in range(0, len(rules), size)]
+    return [score for scores in pool.map(score_forked, jobs) for score in scores]
 
 
-def expand_rule(rule, rule_dict, kg:IncidenceList, ontology:Ontology, pmap:P_map, type_predicate, expand_fun, onto_safe):
+"""expands all paths of rule, except the paths whose head is in covered"""
+def expand_rule(rule, rule_dict, kg:IncidenceList, ontology:Ontology, pmap:P_map, type_predicate, expand_fun, onto_safe, covered:set=None):
     for path in rule_dict[rule]:
-        expand_fun(rule_dict, path, kg, ontology, pmap, type_predicate, onto_safe)
+        if covered and (path.head[0], path.head[2]) in covered:
+            continue
+        expand_fun(rule_dict, path, rule, kg, ontology, pmap, type_predicate, onto_safe)
     #print(len(rule_dict))
 
 def fits_max_depth_rudik(r:Rule, max_depth):
     return len(r.body) < max_depth
 
 
-"""expands given path by one from frontiers, creates straight paths in line with RuDiK"""
-def expand_path_rudik(rule_dict:dict, path:Path, kg:IncidenceList, ontology:Ontology, pmap:P_map, type_predicate:str, onto_safe):
-
-    # find  leaf, head object doesn't count
-    f = path.frontiers_rudik()
-
-    if f == None:
-        print(f"no frontier for {path}")
-        print(path.frontiers_rudik())
-        exit()
-
-    # TODO literal comparisons
-    if is_literal(f):
-        pass
-
-    preds = kg.nodes.get(f)
-
-    for p in preds:
-        # don't want to traverse type triples or negative triples
-        if pmap.original_pred(p) == type_predicate or p in pmap.neg_predicate_mappings:
-            continue
-
+"""expands given path of rule by one from frontiers, creates straight paths in line with RuDiK"""
+def expand_path_rudik(rule_dict:dict, path:Path, rule:Rule, kg:IncidenceList, ontology:Ontology, pmap:P_map, type_predicate:str, onto_safe):
 
-        for pair in kg.edges.get(p):
-            if f in pair:
-            # cannot jump through kg
+    # leaf the path is expanded from, head object doesn't count
+    f = path.frontier
 
-                triple = (pair[0],p, pair[1])
-                edges_p = path.graph.edges.get(p)
-                if ( edges_p and  pair in edges_p) or triple == path.head:
-                # we only want triples that are not in path, need to check head seperately here
-                    continue
+    # hubs (e.g. a "male" object) would connect the path to a large part of the graph
+    if pmap.stats and pmap.stats.hub_degree != None and kg.degree(f) > pmap.stats.hub_degree:
+        return
 
+    # TODO literal comparisons (check is_literal(kg.decode(f)) only once they are implemented, decoding here is costly)
 
-                # e is entity path is expanded to
-                e = pair[0] if pair[1] == f else pair[1]
+    def add_path(pair, p, e, direction):
+        triple = (pair[0],p, pair[1])
+        if triple in path or triple == path.head:
+        # we only want triples that are not in path, need to check head seperately here
+            return
 
-                if e != f and e in path.graph.nodes:
-                # don't want circles, except when s = o
-                    continue
+        if e != f and e in path.visited:
+        # don't want circles, except when s = o
+            return
 
-                if onto_safe or fits_domain_range(e, triple, ontology, kg, pmap, type_predicate):
+        if onto_safe or fits_domain_range(e, triple, ontology, kg, pmap, type_predicate):
 
-                    
-                    new = path.copy()
+            # the new path shares the atoms of path
+            new = path.extend(triple)
 
-                    new.graph.add(pair[0], p, pair[1])
+            # derived from the rule of path, the same for every path of rule that is extended this way
+            r = rule.extend(pmap.original_pred(p), direction, e != f and e == path.head[2])
 
-                    r = new.rule_rudik(pmap)
 
+            if r in rule_dict:
+                rule_dict[r][new] = None
+            else:
+                rule_dict[r] = {new: None}
 
-                    if r in rule_dict:
-                        rule_dict[r].add(new)
-                    else:
-                        rule_dict[r] = {new}
+    # only the edges at f are visited via the adjacency index, e is entity path is expanded to
+    for p, objects in kg.out_edges(f):
+        # don't want to traverse type triples or negative triples
+        if pmap.original_pred(p) == type_predicate or p in pmap.neg_predicate_mappings:
+            continue
+        for e in objects:
+            add_path((f, e), p, e, "self" if e == f else "out")
 
+    for p, subjects in kg.in_edges(f):
+        if pmap.original_pred(p) == type_predicate or p in pmap.neg_predicate_mappings:
+            continue
+        for e in subjects:
+            if e == f:
+                # self circles were already handled as outgoing edge
+                continue
+            add_path((e, f), p, e, "in")
 
     return 
 
@@ -461,7 +626,7 @@ def expand_path_rudik(rule_dict:dict, path:Path, kg:IncidenceList, ontology:Onto
 def fits_max_depth_branch(r:Rule, max_depth):
     pass
 
-def expand_path_branch(path:Path, kg:IncidenceList, ontology:Ontology, pmap:P_map, type_predicate:str):
+def expand_path_branch(path:Path, rule:Rule, kg:IncidenceList, ontology:Ontology, pmap:P_map, type_predicate:str):
     pass
 
 
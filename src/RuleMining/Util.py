@@ -1,7 +1,13 @@
 import random
+import gc
+import os
+import re
+import multiprocessing
+import json
 import numpy as np
-from itertools import combinations 
-from RuleMining.Classes import Path, Rule, P_map, IncidenceList, Ontology, is_literal_comp
+from hashlib import sha256
+from itertools import combinations, chain
+from RuleMining.Classes import Path, Rule, P_map, IncidenceList, EncodedIncidenceList, FrozenGraph, TermDict, MappedTermDict, GraphStatistics, Ontology, CoverageCache, ExampleSet, RuleListCoverage, is_literal_comp
 import time
 
 ########################################
@@ -9,12 +15,151 @@ import time
 ########################################
 
 
-"""parse a graph from nt file into IncidenceList"""
+"""
+parse a graph from nt file into IncidenceList, for an EncodedIncidenceList the term dictionary is filled on the way.
+inserting into the graph is serial anyway, for parsing in parallel see load_graph
+"""
 def parseGraph(ntFilePath, graph:IncidenceList, prefix=""):
-    with open(ntFilePath, 'r', encoding='utf-8') as file:
-        for row in file:
-            triple = tripleRemovePrefix(row.split()[0:3], prefix)
-            graph.add(triple[0], triple[1], triple[2])
+    start = time.time()
+    intern = graph.encode if isinstance(graph, EncodedIncidenceList) else None
+
+    count = 0
+    # the graph only allocates acyclic containers, cyclic gc passes while it is built would just rescan them over and over
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for triples in iter_ntriples(ntFilePath, prefix, intern):
+            graph.add_triples(triples)
+            count += len(triples)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    duration = max(time.time() - start, 1e-9)
+    print(f"parsed {count} triples from {ntFilePath} in {duration:.2f} s ({count / duration:.0f} triples/s)")
+
+
+"""
+regex for one N-Triples statement, IRIs are matched without <> and prefix, whitespace between the terms is optional. groups:
+    subject IRI, subject blank node, predicate IRI, object IRI, object blank node, object literal
+with iris_only it only matches statements of three IRIs and has just these three groups.
+quantifiers are possessive, the terms can't overlap so backtracking into them never helps
+"""
+def ntriples_regex(prefix:str="", iris_only:bool=False):
+    iri = rf"<(?:{re.escape(prefix)})?+([^>\n]*+)>" if prefix else r"<([^>\n]*+)>"
+    # a label doesn't end with "."
+    blank = r'(_:[^\s<>".]++(?:\.++[^\s<>".]++)*+)'
+    literal = r'("(?:[^"\\\n]|\\.)*+"(?:\^\^<[^>\n]*+>|@[a-zA-Z]++(?:-[a-zA-Z0-9]++)*+)?+)'
+    end = r"[ \t]*+\.[ \t]*+(?:#[^\n]*+)?+\r?$"
+    if iris_only:
+        return re.compile(rf"^[ \t]*+{iri}[ \t]*+{iri}[ \t]*+{iri}{end}", re.MULTILINE)
+    return re.compile(rf"^[ \t]*+(?:{iri}|{blank})[ \t]*+{iri}[ \t]*+(?:{iri}|{blank}|{literal}){end}", re.MULTILINE)
+
+
+"""
+streaming N-Triples tokenizer, reads the file in large binary chunks (cut at line ends) and yields the list of triples of each chunk. 
+IRIs lose <> and the prefix, blank nodes and literals (including escapes, datatype or language tag) are kept as written.
+every term goes through intern (e.g. TermDict.encode) exactly once.
+lines that aren't a statement, comment or blank are skipped with a warning.
+start and end restrict the tokenizer to a byte range of the file, both have to be at the start of a line (see ntriples_ranges).
+chunks are small on purpose, the regex is a lot faster on text that stays in cache.
+"""
+def iter_ntriples(ntFilePath, prefix="", intern=None, chunk_size=1 << 16, start=0, end=None):
+    statement = ntriples_regex(prefix)
+    iri_statement = ntriples_regex(prefix, iris_only=True)
+    empty = re.compile(r"^[ \t]*(?:#[^\n]*)?\r?$", re.MULTILINE)
+    skipped = 0
+
+    def tokenize(text):
+        nonlocal skipped
+        # without literals and blank nodes the matches are the triples already
+        iris_only = '"' not in text and "_:" not in text
+        matches = (iri_statement if iris_only else statement).findall(text)
+        lines = text.count("\n") + 1
+        if len(matches) != lines:
+            # blank lines and comments are fine, everything else is malformed
+            skipped += lines - len(matches) - len(empty.findall(text))
+        if iris_only:
+            if intern:
+                return [(intern(s), intern(p), intern(o)) for s, p, o in matches]
+            return matches
+        if intern:
+            return [(intern(m[0] or m[1]), intern(m[2]), intern(m[3] or m[4] or m[5])) for m in matches]
+        return [(m[0] or m[1], m[2], m[3] or m[4] or m[5]) for m in matches]
+
+    with open(ntFilePath, 'rb') as file:
+        file.seek(start)
+        remaining = end - start if end != None else -1
+        rest = b""
+        while remaining != 0:
+            chunk = file.read(chunk_size if remaining < 0 else min(chunk_size, remaining))
+            if remaining > 0:
+                remaining -= len(chunk)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            line_end = chunk.rfind(b"\n")
+            if line_end < 0:
+                # no line end in chunk, line continues in next chunk
+                rest = chunk
+                continue
+            rest = chunk[line_end + 1:]
+            yield tokenize(chunk[:line_end].decode('utf-8'))
+        if rest.strip():
+            yield tokenize(rest.decode('utf-8'))
+
+    if skipped:
+        print(f"skipped {skipped} malformed lines in {ntFilePath}")
+
+
+"""split an nt file into at most parts byte ranges (start, end) of about the same size, every range starts at the beginning of a line"""
+def ntriples_ranges(ntFilePath, parts:int):
+    size = os.path.getsize(ntFilePath)
+    bounds = [0]
+    with open(ntFilePath, 'rb') as file:
+        for i in range(1, parts):
+            file.seek(max(size * i // parts - 1, bounds[-1]))
+            # move to the start of the next line
+            file.readline()
+            bounds.append(min(file.tell(), size))
+    bounds.append(size)
+    return [(s, e) for s, e in zip(bounds, bounds[1:]) if s < e]
+
+
+"""
+worker of iter_ntriples_parallel: parses one byte range into a local term list and an (n, 3) integer array of triples over the local ids
+"""
+def parse_ntriples_range(args):
+    ntFilePath, prefix, start, end = args
+    terms = TermDict()
+    triples = chain.from_iterable(chain.from_iterable(iter_ntriples(ntFilePath, prefix, terms.encode, start=start, end=end)))
+    ids = np.fromiter(triples, dtype=np.int64)
+    dtype = np.int32 if len(terms) < 2**31 else np.int64
+    return terms.terms, ids.astype(dtype).reshape(-1, 3)
+
+
+"""
+parses an nt file with workers processes, each parsing byte ranges of the file (see parse_ntriples_range).
+yields (local terms, local triples) per range in file order, so merging the local terms in this order assigns the same ids as a sequential parse.
+"""
+def iter_ntriples_parallel(ntFilePath, prefix="", workers:int=2):
+    # a few ranges per worker, so one slow range doesn't keep the others waiting
+    ranges = ntriples_ranges(ntFilePath, workers * 4)
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(parse_ntriples_range, [(ntFilePath, prefix, start, end) for start, end in ranges])
+
+
+"""
+merges the results of iter_ntriples_parallel into the term dictionary terms, returns the triples as (n, 3) integer array over the ids of terms
+"""
+def merge_ntriples_parallel(ntFilePath, terms:TermDict, prefix="", workers:int=2):
+    merged = []
+    for local_terms, local_triples in iter_ntriples_parallel(ntFilePath, prefix, workers):
+        remap = np.fromiter((terms.encode(t) for t in local_terms), dtype=np.int64, count=len(local_terms))
+        merged.append(remap[local_triples])
+    if not merged:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(merged)
 
 
 """parse a .ttl ontology into Ontology Type"""
@@ -219,11 +364,146 @@ def parseOntology(ontology_file:str, ontology:Ontology, prefix:str=""):
 
 
 def check_preds_in_graph(neg_predicate_mappings, kg:IncidenceList):
+    if not isinstance(kg, IncidenceList):
+        # a FrozenGraph has no entries to add, unknown predicates just have no pairs
+        return
     for p in neg_predicate_mappings.values():
         if p not in kg.edges:
             kg.edges[p] = set()
 
 
+########################################
+# graph snapshots
+########################################
+
+# bump when the snapshot layout changes, older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+
+"""size, modification time and sha256 of a file, the hash is only computed if asked for"""
+def file_fingerprint(path:str, with_hash:bool=True):
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        h = sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 24), b""):
+                h.update(chunk)
+        fingerprint["sha256"] = h.hexdigest()
+    return fingerprint
+
+
+"""
+checks a fingerprint (see file_fingerprint) against the current source file, the content is only hashed if the modification time changed.
+returns (matches, touched), touched if the file matches but has a new modification time, which is then updated in fingerprint
+"""
+def same_source(fingerprint:dict, source:str):
+    current = file_fingerprint(source, with_hash=False)
+    if current["size"] != fingerprint["size"]:
+        return False, False
+    if current["mtime_ns"] == fingerprint["mtime_ns"]:
+        return True, False
+    current = file_fingerprint(source)
+    if current["sha256"] != fingerprint["sha256"]:
+        return False, False
+    fingerprint["mtime_ns"] = current["mtime_ns"]
+    return True, True
+
+
+"""
+writes a FrozenGraph (built from a TermDict) to directory: the arrays as .npy files, the terms as MappedTermDict and a meta.json 
+identifying the source file it was parsed from
+"""
+def save_snapshot(graph:FrozenGraph, directory:str, source:str, prefix:str):
+    os.makedirs(directory, exist_ok=True)
+    meta_file = f"{directory}/meta.json"
+    # meta is written last, a snapshot that was not written completely is never loaded
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    MappedTermDict.save(graph.terms, directory)
+    for name in FrozenGraph.ARRAYS:
+        np.save(f"{directory}/{name}.npy", np.asarray(getattr(graph, name)))
+
+    meta = {"version": SNAPSHOT_VERSION, "source": os.path.basename(source), "prefix": prefix, "triples": len(graph)}
+    meta.update(file_fingerprint(source))
+    with open(meta_file, 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=4)
+
+
+"""
+loads the snapshot in directory as FrozenGraph with memory mapped arrays and terms, 
+returns None if there is none or it doesn't match the current source file
+"""
+def load_snapshot(directory:str, source:str, prefix:str):
+    meta_file = f"{directory}/meta.json"
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    if meta.get("version") != SNAPSHOT_VERSION or meta.get("prefix") != prefix or meta.get("source") != os.path.basename(source):
+        return None
+
+    matches, touched = same_source(meta, source)
+    if not matches:
+        return None
+    if touched:
+        with open(meta_file, 'w', encoding='utf-8') as file:
+            json.dump(meta, file, indent=4)
+
+    arrays = {name: np.load(f"{directory}/{name}.npy", mmap_mode='r') for name in FrozenGraph.ARRAYS}
+    return FrozenGraph(arrays, MappedTermDict.load(directory))
+
+
+"""
+get the graph of an nt file as FrozenGraph, from its snapshot if that is up to date, 
+else the file is parsed and the snapshot is (re)written
+"""
+def load_graph(ntFilePath:str, prefix:str, snapshot_dir:str, workers:int=1):
+    graph = load_snapshot(snapshot_dir, ntFilePath, prefix)
+    if graph != None:
+        print(f"loaded graph snapshot from {snapshot_dir} ({len(graph)} triples)")
+        return graph
+
+    if workers > 1:
+        # the integer triples of the workers go straight into the arrays, no IncidenceList in between
+        start = time.time()
+        terms = TermDict()
+        triples = merge_ntriples_parallel(ntFilePath, terms, prefix, workers)
+        graph = FrozenGraph.from_triples(triples[:, 0], triples[:, 1], triples[:, 2], terms)
+        duration = max(time.time() - start, 1e-9)
+        print(f"parsed {len(triples)} triples from {ntFilePath} with {workers} workers in {duration:.2f} s ({len(triples) / duration:.0f} triples/s)")
+    else:
+        kg = EncodedIncidenceList()
+        parseGraph(ntFilePath, kg, prefix)
+        graph = FrozenGraph.from_incidence_list(kg)
+    save_snapshot(graph, snapshot_dir, ntFilePath, prefix)
+    print(f"wrote graph snapshot to {snapshot_dir} ({len(graph)} triples)")
+    return graph
+
+
+"""
+get the GraphStatistics of graph, parsed from the nt file source. they are read from path if they were computed for 
+the current content of source, else computed and written to path
+"""
+def load_statistics(graph, source:str, path:str):
+    if os.path.exists(path):
+        stats, fingerprint = GraphStatistics.load(path, graph.encode)
+        if stats != None:
+            matches, touched = same_source(fingerprint, source)
+            if matches:
+                if touched:
+                    stats.save(path, graph.decode, fingerprint)
+                print(f"loaded graph statistics from {path}")
+                return stats
+
+    start = time.time()
+    stats = GraphStatistics.from_graph(graph)
+    stats.save(path, graph.decode, file_fingerprint(source))
+    print(f"computed statistics of {len(stats.predicates)} predicates in {time.time() - start:.2f} s, wrote them to {path}")
+    return stats
+
+
 """remove prefix from triple"""
 def tripleRemovePrefix(triple:tuple[str], prefix:str):    
     if triple[2][0] == "<":
@@ -252,341 +532,233 @@ def tripleAddPrefix(triple:tuple[str], prefix:str):
 unbinds a rule body
 """
 def unbind(r:Rule):
-    out = Rule()
-    out.head = r.head
+    connections = set()
     target_vars = set()
     s = r.head[0]
     o = r.head[2]
     for c in r.connections:
         if s in c or o in c:
-            out.connections.add(c)
+            connections.add(c)
             for e in c:
                 target_vars.add(e)
 
-    for atom in r.body:
-        if atom[0] in target_vars or atom[2] in target_vars:
-            out.body.add(atom)
+    body = {atom for atom in r.body if atom[0] in target_vars or atom[2] in target_vars}
 
-    return out
+    return Rule(r.head, body, connections)
 
 
 """
-coverage of r over g
+coverage of r over g, as bitset over examples_g. with a cache the coverage of a rule is only computed again if it got new paths
 """
-def cov_g(r, rule_dict, R_out_dict):
+def cov_g(r, rule_dict, R_out_dict, examples_g:ExampleSet, cache:CoverageCache=None):
     # special case, just check dict entries for each rule and see the heads of the paths and compare to g
-    c = set()
+    c = 0
     if not r:
         return c
     if type(r) == Rule:
         if r in rule_dict:
-            for path in rule_dict[r]:
-                c.add((path.head[0], path.head[2]))
+            paths = rule_dict[r]
         elif r in R_out_dict:
-            for path in R_out_dict[r]:
-                c.add((path.head[0], path.head[2]))  
+            paths = R_out_dict[r]
         else: 
             raise ValueError("unknown rule")  
+        if cache == None:
+            return examples_g.bits((path.head[0], path.head[2]) for path in paths)
+        known = cache.heads.get(r)
+        if known != None and known[0] is paths and known[1] == len(paths):
+            return known[2]
+        c = examples_g.bits((path.head[0], path.head[2]) for path in paths)
+        cache.heads[r] = (paths, len(paths), c)
     elif type(r) == list and r and type(r[0]) == Rule:
         for rule in r:
-            c.update(cov_g(rule, rule_dict, R_out_dict))
+            c |= cov_g(rule, rule_dict, R_out_dict, examples_g, cache)
     else:
         raise ValueError("r must be type Rule or list[Rule]")
     
     return c
 
 
-def patterns_in_graph(rule:Rule, triple_patterns, name_dict, kg:IncidenceList, pmap:P_map):
-    #print(f"call with {triple_patterns} and dict {name_dict}")
-
-    # init: pick 1st triple pattern:
-    # for all possible triples, create a solution object: pick head-s triple pattern
-
-        # II. while unhadled triple patterns:
-                # - pick next triple pattern --> prioritise patterns partly instantiated in solution objects
-                # - for all solution objects, keep and extend the ones that fit
-                # - if no solution objects --> FALSE
-
-        # --> TRUE
-
-    if not triple_patterns:
-        return True
-
-    # init 
-    # find 1st pattern
-    handled_triple_patterns = set()
-    current_pattern = None
-
-    for pattern in triple_patterns:
-        if pattern[0] in name_dict:
-            if pattern[2] in name_dict:
-                if not triple_exists((name_dict[pattern[0]], name_dict[pattern[2]]), pattern[1], kg, pmap):
-                    return False
-                else: 
-                    handled_triple_patterns.add(pattern)
-                    if handled_triple_patterns == triple_patterns:
-                        return True
-                    continue
-            current_pattern = pattern
-            pattern_i = 0
-            pattern_j = 2
-            break
-        if pattern[2] in name_dict:
-            current_pattern = pattern
-            pattern_i = 2
-            pattern_j = 0
-            # TODO check if faster without this break, also in parallel place later, idea: there are objects with a lot of connections e.g. "male", not so much subjects
-            break
-    if not current_pattern:
-        current_pattern = pattern
-
-
-    #print(f"pick pattern {current_pattern}")
-    new_dict = {}
-    solutions = []
-    new_entities = set()
-    new_connections = rule.get_connections(current_pattern[pattern_j])
-
-    for p in kg.nodes[name_dict[current_pattern[pattern_i]]]:
-        if pmap.original_pred(p) == current_pattern[1] and p not in pmap.neg_predicate_mappings:
-            for pair in kg.edges[p]:
-                if pair[int(pattern_i/2)] == name_dict[current_pattern[pattern_i]]:
-                    new_entities.add(pair[int(pattern_j/2)])
-
-    #print(f"found these entities {new_entities}")
-
-    for e in new_entities:
-        for var in new_connections:
-            new_dict[var] = e
-        solutions.append(name_dict | new_dict)
-    handled_triple_patterns.add(current_pattern)
-    if not solutions:
-        return False
-    if handled_triple_patterns == triple_patterns:
-        return True
-
-    #print(f"createtd solutions: {solutions}")
-    while True:
-        # - pick next triple pattern --> prioritise patterns partly instantiated in solution objects
-        #print(f"\n+++start while {handled_triple_patterns}")
-        current_pattern = None
-        for pattern in triple_patterns:
-            if pattern in handled_triple_patterns:
-                continue
-
-            # each solution has the same set of keys
-            current_solution = solutions[0]
-            if pattern[0] in current_solution:
-                if pattern[2] in current_solution:
-                    remaining_solutions = []
-                    for sol in solutions:
-                        if triple_exists((sol[pattern[0]], sol[pattern[2]]), pattern[1], kg, pmap):
-                            remaining_solutions.append(sol)
-                    if not remaining_solutions:
-                        return False
-                    else: 
-                        solutions = remaining_solutions
-                        handled_triple_patterns.add(pattern)
-                        #print(f"add to handled {pattern}")
-                        if handled_triple_patterns == triple_patterns:
-                            #print(f"return true with {solutions}")
-                            return True
-                        continue
-                current_pattern = pattern
-                pattern_i = 0
-                pattern_j = 2
-                break
-            if pattern[2] in current_solution:
-                current_pattern = pattern
-                pattern_i = 2
-                pattern_j = 0
-                break
-
-        if not current_pattern:
-            current_pattern = pattern
-
-
-        # - for all solution objects, keep and extend the ones that fit 
-        # --> all erroneous solutions are already removed, extend now
-        new_connections = rule.get_connections(current_pattern[pattern_j])
-        new_dict.clear()
-        new_solutions = []
-        for sol in solutions:
-            # if a solution is not expandable, it is not added to new solutions
-            new_entities.clear()
-            for p in kg.nodes[sol[current_pattern[pattern_i]]]:
-                if pmap.original_pred(p) == current_pattern[1]:
-                    for pair in kg.edges[p]:
-                        if pair[int(pattern_i/2)] == sol[current_pattern[pattern_i]]:
-                            new_entities.add(pair[int(pattern_j/2)])
-            for e in new_entities:
-                for var in new_connections:
-                    new_dict[var] = e
-                new_solutions.append(sol | new_dict)
-
-        if not new_solutions:
-            return False
-        handled_triple_patterns.add(current_pattern)
-        if handled_triple_patterns == triple_patterns:
-            return True
-        solutions = new_solutions
-        #print(f"got these solutions left {solutions}")
-
-
-def covers_example(rule:Rule, example:tuple[str, str], kg:IncidenceList, pmap:P_map):
-
-# I: in triple patterns, find connected groups, for each:
-
-    # call subfunction:
-        # init: pick 1st triple pattern:
-            # for all possible triples, create a solution object: pick head-s triple pattern
-
-        # II. while unhadled triple patterns:
-                # - pick next triple pattern --> prioritise patterns partly instantiated in solution objects
-                # - for all solution objects, keep and extend the ones that fit
-                # - if no solution objects --> FALSE
-
-        # --> TRUE
-
-
-
-    c_head_s = rule.get_connections(rule.head[0])
-    name_dict_s = {var:example[0] for var in c_head_s}
-    
-
-    if rule.head[2] in c_head_s:
-        if example[0] != example[1]:
-            # ex s and o must be the same if rule.head s and o are
-            return False
-        c_head_o = c_head_s
-        # head s=o, so everything is connected
-        return patterns_in_graph(rule, rule.body, name_dict_s, kg, pmap)
-    c_head_o = rule.get_connections(rule.head[2])
-    name_dict_o = {var:example[1] for var in c_head_o}
-
-    if not c_head_o:
-        # nothing connected to head o, so everything to head s
-
-        return  patterns_in_graph(rule, rule.body, name_dict_s, kg, pmap)
-
-    # find out if there are two unconnected groups of patterns
-    head_s_connected_patterns = set()
-    var_queue = {c_head_s}
-    vars_checked = set()
-    while True:
-        vars_to_check = var_queue.pop()
-        for triple_pattern in rule.body:
-            if triple_pattern in head_s_connected_patterns:
-                continue
-
-            if triple_pattern[0] in vars_to_check:
-                head_s_connected_patterns.add(triple_pattern)
-                if triple_pattern[2] not in vars_to_check and not any(c for c in vars_checked if triple_pattern[2] in c):
-                    var_queue.add(rule.get_connections(triple_pattern[2]))
-
-            if triple_pattern[2] in vars_to_check:
-                head_s_connected_patterns.add(triple_pattern)
-                if not any(c for c in vars_checked if triple_pattern[0] in c):
-                    var_queue.add(rule.get_connections(triple_pattern[0]))
-
-        vars_checked.add(vars_to_check)
-        if not var_queue:
-            break
-    
-
-    if len(head_s_connected_patterns) != len(rule.body):
-        # there are two groups of patterns, start with head o group
-        if not patterns_in_graph(rule, rule.body - head_s_connected_patterns, name_dict_o, kg, pmap):
-            return False
-
-    # check everything connected to head s
-    return patterns_in_graph(rule, head_s_connected_patterns, name_dict_s|name_dict_o, kg, pmap)
-
-
-def triple_exists(pair, original_p, kg:IncidenceList, pmap:P_map):
-    s, o = pair
-    for object_pred in kg.nodes[o]:
-        if pmap.original_pred(object_pred) == original_p:
-            if pair in kg.edges[object_pred]:
-                return True
-    return False
-
-
-def coverage(r, v, kg, pmap):
-    out = set()
-    for example_pair in v:
-        if covers_example(r, example_pair, kg, pmap):
-            out.add(example_pair)
-    return out
+"""
+returns the examples of v that rule covers, checked for all examples at once.
+the body is evaluated as joins over one binding table for all examples: a row holds the example and a value for every
+bound node (connected variables form one node). an atom with both nodes bound filters the rows, an atom with one bound node 
+extends them by the neighbours of the bound value, which are looked up once per distinct value. 
+after every atom the rows are reduced to the nodes later atoms still need, so rows only differing in finished nodes are merged.
+"""
+def covered_examples(rule:Rule, v, kg:IncidenceList, pmap:P_map):
+    examples = list(v)
+    if not examples:
+        return set()
 
+    node = {}
+    for c in rule.connections:
+        for var in c:
+            node[var] = c
+    def node_of(var):
+        return node.get(var, (var,))
+
+    head_s = node_of(rule.head[0])
+    head_o = node_of(rule.head[2])
+    atoms = sorted((node_of(s), p, node_of(o)) for s, p, o in rule.body)
+
+    # rows are (example index, values of columns)
+    if head_s == head_o:
+        columns = [head_s]
+        rows = {(i, ex[0]) for i, ex in enumerate(examples) if ex[0] == ex[1]}
+    else:
+        columns = [head_s, head_o]
+        rows = {(i, ex[0], ex[1]) for i, ex in enumerate(examples)}
+
+    while atoms and rows:
+        # bound atoms first, they only remove rows, then the atom with the smallest fanout from a bound node
+        atom = next((a for a in atoms if a[0] in columns and a[2] in columns), None)
+        if atom == None:
+            reachable = [a for a in atoms if a[0] in columns or a[2] in columns]
+            if reachable:
+                atom = min(reachable, key=lambda a: pmap.fanout(a[1], a[0] in columns))
+            else:
+                atom = atoms[0]
+        atoms.remove(atom)
+        ns, p, no = atom
+
+        if ns in columns and no in columns:
+            i = columns.index(ns) + 1
+            j = columns.index(no) + 1
+            exists = {}
+            new_rows = set()
+            for row in rows:
+                pair = (row[i], row[j])
+                found = exists.get(pair)
+                if found == None:
+                    found = triple_exists(pair, p, kg, pmap)
+                    exists[pair] = found
+                if found:
+                    new_rows.add(row)
+            rows = new_rows
+
+        elif ns in columns or no in columns:
+            outgoing = ns in columns
+            i = columns.index(ns if outgoing else no) + 1
+            columns.append(no if outgoing else ns)
+            neighbors = {}
+            new_rows = set()
+            for row in rows:
+                x = row[i]
+                entities = neighbors.get(x)
+                if entities == None:
+                    entities = neighbor_entities(x, p, outgoing, kg, pmap)
+                    neighbors[x] = entities
+                for e in entities:
+                    new_rows.add(row + (e,))
+            rows = new_rows
 
-def unbounded_coverage(r, v, kg, pmap):
-    return coverage(unbind(r), v, kg, pmap)
+        else:
+            # not connected to anything bound, every instance of p joins every row
+            pairs = [pair for q in pmap.variants(p) for pair in kg.pairs(q)]
+            if ns == no:
+                columns.append(ns)
+                rows = {row + (x,) for row in rows for x, y in pairs if x == y}
+            else:
+                columns.extend((ns, no))
+                rows = {row + pair for row in rows for pair in pairs}
 
+        # drop columns no remaining atom uses
+        needed = [k for k, n in enumerate(columns) if any(n == a[0] or n == a[2] for a in atoms)]
+        if len(needed) < len(columns):
+            columns = [columns[k] for k in needed]
+            rows = {(row[0],) + tuple(row[k + 1] for k in needed) for row in rows}
 
-def rulelist_call_coverage(r, v, kg, pmap, out:set):
-    for example_pair in v:
-        if example_pair in out:
-            continue
-        if covers_example(r, example_pair, kg, pmap):
-            out.add(example_pair)
+    return {examples[row[0]] for row in rows}
 
 
-def rulelist_coverage(R, v, kg, pmap):
+"""entities reached from x over an edge whose original predicate is original_p, negative predicates don't count"""
+def neighbor_entities(x, original_p, outgoing:bool, kg:IncidenceList, pmap:P_map):
     out = set()
-    for rule in R:    
-        rulelist_call_coverage(rule, v, kg, pmap, out)
+    variants = pmap.variants(original_p)
+    if len(variants) < kg.degree(x):
+        # look up the few variants instead of visiting every edge at x
+        for p in variants:
+            out.update(kg.objects(x, p) if outgoing else kg.subjects(x, p))
+        return out
+    edges = kg.out_edges(x) if outgoing else kg.in_edges(x)
+    for p, entities in edges:
+        if p in variants:
+            out.update(entities)
     return out
 
 
-def rulelist_unbounded_coverage(R, v, kg, pmap):
-    out = set()
-    for rule in R:    
-        rulelist_call_coverage(unbind(rule), v, kg, pmap, out)
-    return out
-
+"""whether an edge from pair[0] to pair[1] has original predicate original_p, negative predicates don't count"""
+def triple_exists(pair, original_p, kg:IncidenceList, pmap:P_map):
+    return not pmap.variants(original_p).isdisjoint(kg.pair_predicates(*pair))
 
-"""estimated marginal weight"""
-def est_m_weight(r:Rule, R_out_dict, rule_dict, kg:IncidenceList, g:set, v:set, alpha:float, beta:float, pmap:P_map, R_out_cov_v_cardinality:list, R_out_uncov_v:set):
 
-    # contain only r_out
-    R_out = list(R_out_dict.keys())
+"""coverage of r over the examples of bitset v, only the examples r wasn't evaluated on before are checked"""
+def coverage(r, v:int, kg, pmap, cache:CoverageCache):
+    tested = cache.tested.get(r, 0)
+    covered = cache.covered.get(r, 0)
+    untested = v & ~tested
+    if untested:
+        covered |= cache.examples.bits(covered_examples(r, cache.examples.members(untested), kg, pmap))
+        cache.covered[r] = covered
+        cache.tested[r] = tested | v
+    return covered & v
 
-    # if there is no value pre saved, calculate it else use it
-    if R_out_cov_v_cardinality[0] == None:
-        cardinality_cov_r_out_v = len(rulelist_coverage(R_out, v,kg,  pmap))
-        R_out_cov_v_cardinality[0] = cardinality_cov_r_out_v
-    else:
-        cardinality_cov_r_out_v = R_out_cov_v_cardinality[0]
 
-    # if there is no value pre saved, calculate it else use it
-    if R_out_uncov_v == None:
-        uncov_r_out_v = rulelist_unbounded_coverage(R_out,  v,kg, pmap)
+"""unbind with the result kept in cache, the unbound rule is canonical so rules with the same unbound body share cache entries"""
+def cached_unbind(r:Rule, cache:CoverageCache=None):
+    if cache == None:
+        return unbind(r)
+    unbound = cache.unbound.get(r)
+    if unbound == None:
+        unbound = unbind(r).canonical()
+        cache.unbound[r] = unbound
+    return unbound
 
-        R_out_uncov_v = uncov_r_out_v
-    else:
-        uncov_r_out_v = R_out_uncov_v
 
-    cardinality_uncov_r_out_v = len(uncov_r_out_v)
+def unbounded_coverage(r, v:int, kg, pmap, cache:CoverageCache):
+    return coverage(cached_unbind(r, cache), v, kg, pmap, cache)
 
 
-    # no need to check for the examples already in uncov_r_out_v (--> (v - uncov_r_out_v)),  since uncov_r_v is only used in union 
-    uncov_r_v = unbounded_coverage(r, (v - uncov_r_out_v), kg, pmap)
-    cardinality_uncov_r_out_r_v = len(set.union(uncov_r_out_v, uncov_r_v))
+"""
+coverage of the accepted rule r for R_out_coverage, r needs to be in R_out_dict already
+returns (cov_g, cov_v, uncov_v)
+"""
+def accepted_coverage(r:Rule, rule_dict, R_out_dict, kg:IncidenceList, v:int, pmap:P_map, examples_g:ExampleSet, cache:CoverageCache):
+    return cov_g(r, rule_dict, R_out_dict, examples_g, cache), coverage(r, v, kg, pmap, cache), unbounded_coverage(r, v, kg, pmap, cache)
 
 
+"""alpha part of the estimated marginal weight, it only needs the path heads of r"""
+def est_m_alpha(r:Rule, rule_dict, R_out_dict, g:set, alpha:float, R_out_coverage:RuleListCoverage, examples_g:ExampleSet, cache:CoverageCache=None):
+    return -alpha * (((cov_g(r, rule_dict, R_out_dict, examples_g, cache) & ~R_out_coverage.cov_g).bit_count())/len(g))
 
 
-    if not cardinality_cov_r_out_v:
-    # if this is zero we know the beta part is zero, the divisors will also be zero resulting in error, thus removing beta part altogether
-        return -alpha * ((len(cov_g(r, rule_dict, R_out_dict) - cov_g(R_out, rule_dict, R_out_dict)))/len(g))
-    
-    if not cardinality_uncov_r_out_r_v:
-    # if this is zero there is division by zero in first fraction of beta part, setting it to zero
-        return  -alpha * ((len(cov_g(r, rule_dict, R_out_dict) - cov_g(R_out, rule_dict, R_out_dict)))/len(g)) - beta * (cardinality_cov_r_out_v / cardinality_uncov_r_out_v)
+"""
+beta part of the estimated marginal weight and the number of examples r adds to the unbound coverage of R_out (its spread),
+the spread is None if the beta part is zero without evaluating r.
+"""
+def est_m_beta(r:Rule, kg:IncidenceList, v:int, beta:float, pmap:P_map, R_out_coverage:RuleListCoverage, cache:CoverageCache):
+    covered = R_out_coverage.cov_v.bit_count()
+    if not covered:
+        return 0, None
+    uncovered = R_out_coverage.uncov_v.bit_count()
+    spread = unbounded_coverage(r, v & ~R_out_coverage.uncov_v, kg, pmap, cache).bit_count()
+    return beta * ((covered / (uncovered + spread)) - (covered / uncovered)), spread
 
 
-    return -alpha * ((len(cov_g(r, rule_dict, R_out_dict) - cov_g(R_out, rule_dict, R_out_dict)))/len(g)) + beta * ((cardinality_cov_r_out_v / cardinality_uncov_r_out_r_v) - (cardinality_cov_r_out_v / cardinality_uncov_r_out_v))
+"""
+lower bound of the beta part for a rule with a spread of at most spread, any spread if it is None.
+the unbound coverage of a rule contains the one of every rule it is expanded to and R_out only grows,
+so the spread of a rule also bounds the spread of its expansions later on
+"""
+def est_m_beta_bound(v:int, beta:float, R_out_coverage:RuleListCoverage, spread:int=None):
+    covered = R_out_coverage.cov_v.bit_count()
+    if not covered:
+        return 0
+    uncovered = R_out_coverage.uncov_v.bit_count()
+    rest = (v & ~R_out_coverage.uncov_v).bit_count()
+    if spread != None and spread < rest:
+        rest = spread
+    return beta * ((covered / (uncovered + rest)) - (covered / uncovered))
 
 
 """
@@ -624,14 +796,14 @@ def fits_domain_range(entity, triple, ontology:Ontology, kg:IncidenceList, pmap:
 
     check_domain = False
     check_range = False
-    literal = is_literal(entity)
+    literal = is_literal(kg.decode(entity))
 
     
 
 
 
     
-    if is_literal_comp(triple[1]):
+    if is_literal_comp(kg.decode(triple[1])):
         if literal and is_valid_comp(triple):
             return True
         
@@ -650,8 +822,9 @@ def fits_domain_range(entity, triple, ontology:Ontology, kg:IncidenceList, pmap:
         check_range = True
 
     
-    p = triple[1] 
-    original = pmap.original_pred(p)
+    # ontology is not encoded, compare by term
+    p = kg.decode(triple[1])
+    original = kg.decode(pmap.original_pred(triple[1]))
     # depending on given predicate (old or new), this insures it is found in ontology
     if p in ontology.properties:
         domain_range = ontology.properties[p]
@@ -663,7 +836,7 @@ def fits_domain_range(entity, triple, ontology:Ontology, kg:IncidenceList, pmap:
 
     if literal:
         types = domain_range[1]
-        literal_t = literal_type(entity)
+        literal_t = literal_type(kg.decode(entity))
 
         for t in types:
             if derivable(literal_t, t, ontology.literal_hierarchy):
@@ -674,7 +847,8 @@ def fits_domain_range(entity, triple, ontology:Ontology, kg:IncidenceList, pmap:
     else:
         # get type predicate(s) the entity has 
         # TODO are constraints about type predicate allowed?
-        entity_type_predicates = {tp for tp in kg.nodes[entity] if pmap.predicate_mappings.get(tp) == type_predicate}
+        # types are the objects of the entity's type triples
+        entity_type_predicates = {tp: objects for tp, objects in kg.out_edges(entity) if pmap.predicate_mappings.get(tp) == type_predicate}
         if not entity_type_predicates:
             # entity is missing type
             return False
@@ -687,7 +861,7 @@ def fits_domain_range(entity, triple, ontology:Ontology, kg:IncidenceList, pmap:
             fits_d = False
             fits_r = False
             for etp in entity_type_predicates:
-                t = next(p for p in kg.edges[etp])[1]
+                t = kg.decode(next(iter(entity_type_predicates[etp])))
                 if not fits_d and t in types_d:
                     fits_d = True
                 if not fits_r and t in types_r:
@@ -723,7 +897,7 @@ def fits_domain_range(entity, triple, ontology:Ontology, kg:IncidenceList, pmap:
             # get entity's types
             entity_types = set()
             for etp in entity_type_predicates:
-                t = next(p for p in kg.edges[etp])[1]
+                t = kg.decode(next(iter(entity_type_predicates[etp])))
                 if t in types:
                     return True
                 if t in ontology.classes:
@@ -781,28 +955,6 @@ def derivable(literal_type, t, hierarchy):
 
 
 
-###################################
-# predicate mappings
-###################################
-"""
-get post normalization predicates from their pre-normalization predecessor via dict
-"""
-def new_preds(original_pred:str, map:dict):
-    # map should be predicate mappings dict
-    if type(map) == dict:
-        return {k for k, v in map.items() if v == original_pred}
-    return None
-
-"""
-get existing negative variants of post-normalization predicates via dict
-"""
-def neg_preds(new_preds:set, map):
-    # map should be neg predicate mappings dict
-    if type(map) == dict:
-        return {k for k, v in map.items() if v in new_preds}
-    return None
-
-
 #########################################
 # example generation
 #########################################
@@ -822,18 +974,17 @@ def getExamples(kg:IncidenceList, preds:set, count:int, ontology, pmap, type_pre
 
     eligible_preds_copy = eligible_preds.copy()
     for p in eligible_preds_copy:
-        edges_p = kg.edges.get(p)
-        if not edges_p:
+        l = pmap.stats.triples(p) if pmap.stats else kg.edge_count(p)
+        if not l:
             continue
 
-        l = len(edges_p) 
         if l <= (max_i + 1):
             # if all instances of predicate will be used, remove
             eligible_preds.remove(p)
         
         # add even share of elements per predicate, if possible
         i = 0
-        for n in edges_p:
+        for n in kg.pairs(p):
             triple = (n[0], p, n[1])
             if triple not in g:
                 if fits_domain_range(n[0], triple, ontology, kg, pmap, type_predicate) and fits_domain_range(n[1], triple, ontology, kg, pmap, type_predicate):
@@ -874,18 +1025,17 @@ def getNegExamples(kg:IncidenceList, preds:set, count:int):
     eligible_preds_copy = eligible_preds.copy()
 
     for p in eligible_preds_copy:
-        edges_p = kg.edges.get(p)
-        if not edges_p:
+        l = kg.edge_count(p)
+        if not l:
             continue
 
-        l = len(edges_p) 
         if l <= (max_i + 1):
             # if all instances of predicate will be used, remove
             eligible_preds.remove(p)
         
         # add even share of elements per predicate, if possible
         i = 0
-        for n in edges_p:
+        for n in kg.pairs(p):
             pair = (n[0], n[1])
             if pair not in v:
                 v.add(pair)
@@ -917,7 +1067,7 @@ def getExamplesLCWA(kg:IncidenceList, ontology:Ontology, pmap:P_map, count:int,
     subjects = set()
     objects = set()
     for p in preds:
-        edges = kg.edges.get(p)
+        edges = kg.pairs(p)
         if edges:
             forbidden_edges.update(edges)
             subjects.update({pair[0] for pair in edges})
@@ -949,7 +1099,7 @@ def getRandomNegExamples(kg:IncidenceList, preds:set, count:int, v=set()):
 
     forbidden_pairs = set()
     for p in preds:
-        ed = kg.edges.get(p)
+        ed = kg.pairs(p)
         if ed:
             forbidden_pairs.update(ed)
 
@@ -964,7 +1114,7 @@ def getRandomNegExamples(kg:IncidenceList, preds:set, count:int, v=set()):
 
     entities = []
 
-    for e in kg.nodes:
+    for e in kg.entities():
 
         entities.append(e)
         ct += 1
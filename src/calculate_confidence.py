@@ -1,6 +1,8 @@
 import csv
 import re
+import numpy as np
 from rdflib import Graph
+from RuleMining.Classes import GraphStatistics, TermDict
 
 
 def load_knowledge_graph(nt_file):
@@ -12,6 +14,27 @@ def load_knowledge_graph(nt_file):
     return g
 
 
+def graph_statistics(g):
+    """
+    Build per-predicate statistics of the knowledge graph in one pass over its triples
+
+    Returns: (stats, terms), a GraphStatistics over the ids of the TermDict terms
+    """
+    terms = TermDict()
+    ids = np.fromiter((terms.encode(str(e)) for triple in g for e in triple), dtype=np.int64, count=3 * len(g)).reshape(-1, 3)
+    return GraphStatistics.from_triples(ids[:, 0], ids[:, 1], ids[:, 2]), terms
+
+
+def head_predicate_id(head_pattern, terms, namespace_uri):
+    """
+    Id of the head predicate if both head terms are distinct variables, then the statistics describe the head pattern
+    """
+    subj, pred, obj = head_pattern
+    if subj.startswith('?') and obj.startswith('?') and subj != obj:
+        return terms.lookup(f"{namespace_uri}{pred}")
+    return None
+
+
 def parse_rule(body, head):
     """
     Parse body and head into structured format
@@ -71,7 +94,7 @@ def build_sparql_patterns(patterns, namespace_prefix='ex', namespace_uri='http:/
     return '\n'.join(sparql_lines)
 
 
-def calculate_std_confidence(g, body, head, namespace_prefix='ex', namespace_uri='http://example.org/'):
+def calculate_std_confidence(g, body, head, namespace_prefix='ex', namespace_uri='http://example.org/', stats=None, terms=None):
     """
     Calculate Standard Confidence using the template:
     SELECT (xsd:float(?PEHead)/xsd:float(?PFHead) AS ?Confidence) WHERE {
@@ -85,6 +108,7 @@ def calculate_std_confidence(g, body, head, namespace_prefix='ex', namespace_uri
             HeadTriplePattern
         }}
     }
+    With statistics (see graph_statistics) PFHead is the triple count of the head predicate
     """
     body_patterns, head_pattern, head_vars = parse_rule(body, head)
 
@@ -111,6 +135,7 @@ SELECT (COUNT(*) AS ?PEHead) WHERE {{
         pe_head = int(result_pe[0][0]) if result_pe and result_pe[0][0] else 0
 
         # Step 2: Calculate PFHead (head coverage) - count where head is true
+        head_id = head_predicate_id(head_pattern, terms, namespace_uri) if stats else None
         query_pf_head = f"""
 PREFIX {namespace_prefix}: <{namespace_uri}>
 SELECT (COUNT(*) AS ?PFHead) WHERE {{
@@ -119,8 +144,11 @@ SELECT (COUNT(*) AS ?PFHead) WHERE {{
     }}
 }}
 """
-        result_pf = list(g.query(query_pf_head))
-        pf_head = int(result_pf[0][0]) if result_pf and result_pf[0][0] else 0
+        if head_id is not None:
+            pf_head = stats.triples(head_id)
+        else:
+            result_pf = list(g.query(query_pf_head))
+            pf_head = int(result_pf[0][0]) if result_pf and result_pf[0][0] else 0
 
         # Calculate confidence
         if pf_head > 0:
@@ -134,7 +162,7 @@ SELECT (COUNT(*) AS ?PFHead) WHERE {{
         return None
 
 
-def calculate_pca_confidence(g, body, head, namespace_prefix='ex', namespace_uri='http://example.org/'):
+def calculate_pca_confidence(g, body, head, namespace_prefix='ex', namespace_uri='http://example.org/', stats=None, terms=None):
     """
     Calculate PCA Confidence using the template:
     SELECT (xsd:float(?Support)/xsd:float(?PCABodySize) AS ?PCA) WHERE {
@@ -151,6 +179,10 @@ def calculate_pca_confidence(g, body, head, namespace_prefix='ex', namespace_uri
             }
         }}
     }
+    With statistics (see graph_statistics) the functional head variable is the subject if the head predicate's
+    functionality is at least its inverse functionality, else the object. The other head variable is replaced in the PCA head pattern.
+
+    Returns: (pca_confidence, support, pca_body_size, functional_variable), functional_variable is '' without statistics
     """
     body_patterns, head_pattern, head_vars = parse_rule(body, head)
 
@@ -171,6 +203,17 @@ def calculate_pca_confidence(g, body, head, namespace_prefix='ex', namespace_uri
     if not pca_head_obj.startswith('?'):
         pca_head_obj = '?pcaVar2'
 
+    # Replace the non-functional head variable
+    functional_variable = ''
+    head_id = head_predicate_id(head_pattern, terms, namespace_uri) if stats else None
+    if head_id is not None:
+        if stats.functionality(head_id) >= stats.inverse_functionality(head_id):
+            functional_variable = pca_head_subj
+            pca_head_obj = '?pcaVar2'
+        else:
+            functional_variable = pca_head_obj
+            pca_head_subj = '?pcaVar1'
+
     pca_head_pattern = (pca_head_subj, pca_head_pred, pca_head_obj)
     pca_head_sparql = build_sparql_patterns([pca_head_pattern], namespace_prefix, namespace_uri)
 
@@ -204,9 +247,9 @@ SELECT (COUNT(*) AS ?PCABodySize) WHERE {{
         # Calculate PCA confidence
         if pca_body_size > 0:
             pca_confidence = support / pca_body_size
-            return pca_confidence, support, pca_body_size
+            return pca_confidence, support, pca_body_size, functional_variable
         else:
-            return 0.0, support, pca_body_size
+            return 0.0, support, pca_body_size, functional_variable
 
     except Exception as e:
         print(f"  Error calculating PCA confidence: {e}")
@@ -226,6 +269,8 @@ def add_confidence_scores(csv_file, nt_file, output_file, namespace_prefix='ex',
     """
     # Load knowledge graph
     g = load_knowledge_graph(nt_file)
+    stats, terms = graph_statistics(g)
+    print(f"Computed statistics of {len(stats.predicates)} predicates")
 
     print(f"Using namespace: {namespace_prefix} -> <{namespace_uri}>")
 
@@ -248,7 +293,7 @@ def add_confidence_scores(csv_file, nt_file, output_file, namespace_prefix='ex',
             print(f"  Head: {head[:80]}{'...' if len(head) > 80 else ''}")
 
         # Calculate Std Confidence
-        std_result = calculate_std_confidence(g, body, head, namespace_prefix, namespace_uri)
+        std_result = calculate_std_confidence(g, body, head, namespace_prefix, namespace_uri, stats, terms)
         if std_result:
             std_conf, pe_head, pf_head = std_result
             rule['Std Confidence'] = std_conf
@@ -264,10 +309,11 @@ def add_confidence_scores(csv_file, nt_file, output_file, namespace_prefix='ex',
                 print(f"  Std Confidence: Could not calculate")
 
         # Calculate PCA Confidence
-        pca_result = calculate_pca_confidence(g, body, head, namespace_prefix, namespace_uri)
+        pca_result = calculate_pca_confidence(g, body, head, namespace_prefix, namespace_uri, stats, terms)
         if pca_result:
-            pca_conf, support, pca_body_size = pca_result
+            pca_conf, support, pca_body_size, functional_variable = pca_result
             rule['PCA Confidence'] = pca_conf
+            rule['Functional variable'] = functional_variable
             rule['Body size'] = len(body.split('   ')) if body else 0
             rule['PCA Body size'] = pca_body_size
             if i <= 3 or i % 20 == 0:
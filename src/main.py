@@ -5,14 +5,18 @@ from pandasql import sqldf
 from rdflib import Graph, URIRef
 import re
 import os
+import mmap
 import time
 import shutil
 import sys
+import numpy as np
+from itertools import chain
 from Normalization.Validation import travshacl
 from Normalization.Normalization_transform import transform
 from RuleMining.Rule_mining import mine_rules
-from RuleMining.Util import parseGraph, parseOntology
-from RuleMining.Classes import IncidenceList, Ontology
+from RuleMining.Util import load_graph, load_statistics, parseOntology, ntriples_ranges
+from multiprocessing import Pool
+from RuleMining.Classes import Ontology
 
 import logging
 
@@ -35,6 +39,12 @@ def initialize(input_config):
             - constraints (str): Path to the constraints folder.
             - kg (str): Name of the knowledge graph (KG).
             - pca_threshold (float): PCA threshold value from the configuration file.
+            - parse_workers (int): Number of processes used to parse the N-Triples files.
+            - mine_workers (int): Number of processes mining the target predicates.
+            - target_workers (int): Number of processes mining a single target predicate.
+            - hub_percentile (int): Paths are not expanded from entities with a degree above this percentile, None for no limit.
+            - rules_jsonl (str): Path to the .jsonl file the rules are written to as well, None if not wanted.
+            - sort_rules (bool): Whether the rules file is sorted once all targets are mined.
     """
     print(f"Reading configuration from {input_config}")
     with open(input_config, "r") as input_file_descriptor:
@@ -70,6 +80,33 @@ def initialize(input_config):
 
     onto_valid = True if input_data["onto-valid"] else False
 
+    if not input_data.get('parse_workers'):
+        workers = 1
+    else:
+        workers = int(input_data['parse_workers'])
+
+    if not input_data.get('mine_workers'):
+        mine_workers = 1
+    else:
+        mine_workers = int(input_data['mine_workers'])
+
+    if not input_data.get('target_workers'):
+        target_workers = 1
+    else:
+        target_workers = int(input_data['target_workers'])
+
+    if not input_data.get('hub_percentile'):
+        hub_percentile = None
+    else:
+        hub_percentile = int(input_data['hub_percentile'])
+
+    if not input_data.get('rules_jsonl'):
+        rules_jsonl = None
+    else:
+        rules_jsonl = os.path.join('Data', 'Rules', input_data['rules_jsonl'])
+
+    sort_rules = True if input_data.get('sort_rules') else False
+
     logger.info(f"Configuration loaded:\n "
           f"- Prefix: {prefix}\n"
           f"- Rules file: {rules_path}\n"
@@ -81,8 +118,77 @@ def initialize(input_config):
           f"- type_predicate: {type_predicate}\n"
           f"- alpha: {alpha}\n"
           f"- mining {"negative" if negative_rules else "positive"} rules\n"
+          f"- parse workers: {workers}\n"
+          f"- mine workers: {mine_workers}\n"
+          f"- target workers: {target_workers}\n"
+          f"- hub percentile: {hub_percentile}\n"
+          f"- JSONL rules file: {rules_jsonl}\n"
+          f"- sort rules: {sort_rules}\n"
     )
-    return prefix, rules_path, rdf_path, kg_path, ontology_path, predictions_folder, constraints_folder, kg_name, max_depth, set_size, type_predicate, alpha, negative_rules, onto_valid
+    return prefix, rules_path, rdf_path, kg_path, ontology_path, predictions_folder, constraints_folder, kg_name, max_depth, set_size, type_predicate, alpha, negative_rules, onto_valid, workers, mine_workers, target_workers, hub_percentile, rules_jsonl, sort_rules
+
+def parse_nt_range(args):
+    """
+    Parses one byte range of an N-Triples file with rdflib, used as worker of parse_nt.
+
+    Args:
+        args (tuple): path of the file and the start and end of the range, both at the start of a line.
+
+    Returns:
+        tuple: The distinct terms of the range in order of first occurrence and an (n, 3) integer
+        array of its triples over the positions of the terms, so every term is only pickled once.
+    """
+    rdf_path, start, end = args
+    with open(rdf_path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    part = Graph()
+    part.parse(data=data.decode('utf-8'), format='nt')
+    terms = {}
+    ids = np.fromiter(chain.from_iterable((terms.setdefault(t, len(terms)) for t in triple) for triple in part), dtype=np.int64)
+    return list(terms), ids.reshape(-1, 3)
+
+def has_blank_nodes(rdf_path):
+    """
+    Checks if an N-Triples file may contain blank nodes. Any "_:" counts, also inside IRIs or literals.
+
+    Args:
+        rdf_path (str): Path to the N-Triples file.
+
+    Returns:
+        bool: False if the file certainly has no blank nodes.
+    """
+    if os.path.getsize(rdf_path) == 0:
+        return False
+    with open(rdf_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return data.find(b"_:") >= 0
+
+def parse_nt(rdf_path, workers=1):
+    """
+    Parses an N-Triples file into an rdflib Graph. With more than one worker the file is
+    split at line boundaries and the ranges are parsed in separate processes.
+    rdflib gives every parse its own blank nodes, so a label used in two ranges would become
+    two nodes. Files that may contain blank nodes are therefore parsed sequentially.
+
+    Args:
+        rdf_path (str): Path to the N-Triples file.
+        workers (int): Number of processes.
+
+    Returns:
+        Graph: The parsed graph.
+    """
+    g = Graph()
+    if workers > 1 and has_blank_nodes(rdf_path):
+        print(f"{rdf_path} may contain blank nodes, parsing it sequentially.")
+        workers = 1
+    if workers <= 1:
+        g.parse(rdf_path, format='nt')
+        return g
+    ranges = ntriples_ranges(rdf_path, workers * 4)
+    with Pool(workers) as pool:
+        for terms, triples in pool.imap(parse_nt_range, [(rdf_path, start, end) for start, end in ranges]):
+            g.addN((terms[s], terms[p], terms[o], g) for s, p, o in triples.tolist())
+    return g
 
 def delete_existing_result(pfad):
     if os.path.exists(pfad) and os.path.isdir(pfad):
@@ -137,7 +243,7 @@ if __name__ == '__main__':
         logger = logging.getLogger(__name__)
 
         #Initializaing from the input.json file
-        prefix, rules_path, rdf_path, kg_path, ontology_path, predictions_folder, constraints_folder, kg_name, max_depth, set_size, type_predicate, alpha, negative_rules, onto_valid = initialize(input_config)
+        prefix, rules_path, rdf_path, kg_path, ontology_path, predictions_folder, constraints_folder, kg_name, max_depth, set_size, type_predicate, alpha, negative_rules, onto_valid, workers, mine_workers, target_workers, hub_percentile, rules_jsonl, sort_rules = initialize(input_config)
 
 
         #delete result folder
@@ -147,8 +253,7 @@ if __name__ == '__main__':
         delete_existing_result(result_path)
         user_input_end_time = time.time()
 
-        g = Graph()
-        g.parse(rdf_path, format='nt')
+        g = parse_nt(rdf_path, workers)
 
 
         # Validate SHACL constraints
@@ -160,12 +265,14 @@ if __name__ == '__main__':
         transformed_kg, transform_output_dir, original_predicates = transform(g,constraints_folder, prefix, kg_name)
 
         time_start_parse = time.time()
-        kg_transformed_i_list = IncidenceList()
-        parseGraph(f"{transform_output_dir}/TransformedKG_{kg_name}.nt", kg_transformed_i_list, prefix)
+        # binary snapshot next to the transformed kg, only parsed again if the file changed
+        kg_transformed_i_list = load_graph(f"{transform_output_dir}/TransformedKG_{kg_name}.nt", prefix, f"{transform_output_dir}/snapshot_{kg_name}", workers)
+        # per-predicate statistics, also kept next to the transformed kg
+        stats = load_statistics(kg_transformed_i_list, f"{transform_output_dir}/TransformedKG_{kg_name}.nt", f"{transform_output_dir}/statistics_{kg_name}.json")
         o = Ontology()
         parseOntology(ontology_path, o, prefix)
         time_start_mining = time.time()
-        mine_rules(kg_transformed_i_list,  original_predicates, transform_output_dir, o, rules_path, prefix, max_depth, set_size, alpha, type_predicate, negative_rules=negative_rules, onto_valid=onto_valid)
+        mine_rules(kg_transformed_i_list,  original_predicates, transform_output_dir, o, rules_path, prefix, max_depth, set_size, alpha, type_predicate, negative_rules=negative_rules, onto_valid=onto_valid, stats=stats, hub_percentile=hub_percentile, workers=mine_workers, target_workers=target_workers, jsonl_file=rules_jsonl, sort_rules=sort_rules)
 
         # Print execution time
         end_time = time.time()
@@ -0,0 +1,99 @@
+from itertools import chain
+
+import pytest
+
+from RuleMining.Util import iter_ntriples
+
+PREFIX = "http://example.org/"
+
+
+def parse(tmp_path, text, **kwargs):
+    """writes text as nt file and returns all triples iter_ntriples yields for it"""
+    path = tmp_path / "graph.nt"
+    path.write_bytes(text.encode("utf-8") if isinstance(text, str) else text)
+    return list(chain.from_iterable(iter_ntriples(str(path), PREFIX, **kwargs)))
+
+
+@pytest.mark.parametrize("literal", [
+    '"Louis the Pious"',
+    '"ends with . <x> ."',
+    '"a \\"quoted\\" name"',
+    '"escaped \\\\"',
+    '"Ludwig"@de',
+    '"Louis"@en-GB',
+    '"814"^^<http://www.w3.org/2001/XMLSchema#gYear>',
+    '""',
+])
+def test_literals_are_kept_as_written(tmp_path, literal):
+    triples = parse(tmp_path, f"<{PREFIX}Louis_I> <{PREFIX}name> {literal} .\n")
+    assert triples == [("Louis_I", "name", literal)]
+
+
+def test_blank_nodes(tmp_path):
+    text = (f"_:b0 <{PREFIX}child> _:node.1 .\n"
+            f"_:node.1 <{PREFIX}name> \"x\".\n")
+    assert parse(tmp_path, text) == [("_:b0", "child", "_:node.1"), ("_:node.1", "name", '"x"')]
+
+
+def test_whitespace_between_terms_is_optional(tmp_path):
+    text = f"<{PREFIX}a><{PREFIX}p><{PREFIX}b>.\n<{PREFIX}a>\t<{PREFIX}p>\t\"b c\" .\n"
+    assert parse(tmp_path, text) == [("a", "p", "b"), ("a", "p", '"b c"')]
+
+
+def test_iris_without_prefix(tmp_path):
+    text = f"<{PREFIX}a> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://other.org/b> .\n"
+    assert parse(tmp_path, text) == [("a", "http://www.w3.org/1999/02/22-rdf-syntax-ns#type", "http://other.org/b")]
+
+
+def test_comments_and_blank_lines_are_skipped(tmp_path, capsys):
+    text = (f"# a comment\n"
+            f"\n"
+            f"   \n"
+            f"<{PREFIX}a> <{PREFIX}p> <{PREFIX}b> . # trailing comment\n"
+            f"\t# indented comment\n"
+            f"<{PREFIX}b> <{PREFIX}p> \"# no comment\" .\n")
+    assert parse(tmp_path, text) == [("a", "p", "b"), ("b", "p", '"# no comment"')]
+    assert "skipped" not in capsys.readouterr().out
+
+
+def test_malformed_lines_are_reported(tmp_path, capsys):
+    text = f"<{PREFIX}a> <{PREFIX}p> <{PREFIX}b> .\n<{PREFIX}a> <{PREFIX}p> .\n"
+    assert parse(tmp_path, text) == [("a", "p", "b")]
+    assert "skipped 1 malformed lines" in capsys.readouterr().out
+
+
+def test_crlf_line_ends(tmp_path):
+    text = f"<{PREFIX}a> <{PREFIX}p> <{PREFIX}b> .\r\n<{PREFIX}a> <{PREFIX}p> \"b\"@en .\r\n"
+    assert parse(tmp_path, text) == [("a", "p", "b"), ("a", "p", '"b"@en')]
+
+
+def test_missing_final_newline(tmp_path):
+    text = f"<{PREFIX}a> <{PREFIX}p> <{PREFIX}b> .\n<{PREFIX}b> <{PREFIX}p> \"c\" ."
+    assert parse(tmp_path, text) == [("a", "p", "b"), ("b", "p", '"c"')]
+
+
+def test_non_ascii_terms(tmp_path):
+    text = f"<{PREFIX}François> <{PREFIX}name> \"François à Paris\"@fr .\n"
+    assert parse(tmp_path, text) == [("François", "name", '"François à Paris"@fr')]
+
+
+def test_intern_is_applied_to_every_term(tmp_path):
+    terms = {}
+    triples = parse(tmp_path, f"<{PREFIX}a> <{PREFIX}p> \"b\" .\n_:x <{PREFIX}p> <{PREFIX}a> .\n",
+                    intern=lambda t: terms.setdefault(t, len(terms)))
+    assert triples == [(0, 1, 2), (3, 1, 0)]
+    assert list(terms) == ["a", "p", '"b"', "_:x"]
+
+
+def test_chunk_size_does_not_change_the_triples(tmp_path):
+    text = (f"# header\n"
+            f"<{PREFIX}Louis_I> <{PREFIX}name> \"Louis . the \\\"Pious\\\"\"@en .\r\n"
+            f"_:b1 <{PREFIX}parent> <{PREFIX}Charlemagne> .\n"
+            f"\n"
+            f"<{PREFIX}Charlemagne> <{PREFIX}born> \"742\"^^<http://www.w3.org/2001/XMLSchema#gYear> .\n"
+            f"<{PREFIX}Charlemagne> <{PREFIX}child> <{PREFIX}Louis_I> .\n"
+            f"<{PREFIX}Charlemagne> <{PREFIX}name> \"Charles à Aix\" .")
+    expected = parse(tmp_path, text)
+    assert len(expected) == 5
+    assert parse(tmp_path, text, chunk_size=7) == expected
+    assert parse(tmp_path, text, chunk_size=1) == expected
@@ -0,0 +1,43 @@
+import os
+import random
+
+import pytest
+
+from RuleMining.Classes import EncodedIncidenceList, Ontology
+from RuleMining.Rule_mining import mine_rules
+from RuleMining.Util import parseGraph, parseOntology
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "Data")
+KG_DIR = os.path.join(DATA, "Transformed_FrenchRoyalty")
+PREFIX = "http://FrenchRoyalty.org/"
+TARGETS = {"spouse", "parent", "child", "predecessor"}
+
+
+@pytest.fixture(scope="module")
+def kg():
+    kg = EncodedIncidenceList()
+    parseGraph(os.path.join(KG_DIR, "TransformedKG_FrenchRoyalty.nt"), kg, PREFIX)
+    return kg
+
+
+@pytest.fixture(scope="module")
+def ontology():
+    ontology = Ontology()
+    parseOntology(os.path.join(DATA, "Ontology", "ontology_FrenchRoyalty.ttl"), ontology, PREFIX)
+    return ontology
+
+
+def mine(kg, ontology, path, **kwargs):
+    """mines the fixture targets with a fixed seed, returns the written rules"""
+    random.seed(0)
+    mine_rules(kg, set(TARGETS), KG_DIR, ontology, str(path), PREFIX, 3, 20, **kwargs)
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("kwargs", [{"workers": 2}, {"target_workers": 2}])
+def test_pooled_mining_matches_sequential(kg, ontology, tmp_path, kwargs):
+    sequential = mine(kg, ontology, tmp_path / "sequential.csv")
+    pooled = mine(kg, ontology, tmp_path / "pooled.csv", **kwargs)
+    assert sequential.count("\n") > 1
+    assert pooled == sequential
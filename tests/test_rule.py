@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from RuleMining.Classes import Rule
+
+PREDICATES = ("parent", "child", "spouse")
+HEAD = ("?a", "parent", "?b")
+
+
+def random_body(rng:random.Random):
+    """atoms of a random rule body as (subject node, predicate, object node), nodes 0 and 1 are the head subject and object"""
+    nodes = 2 + rng.randint(0, 3)
+    atoms = []
+    for _ in range(rng.randint(1, 3)):
+        atoms.append((rng.randrange(nodes), rng.choice(PREDICATES), rng.randrange(nodes)))
+    return atoms
+
+
+def build(atoms, rng:random.Random, reflexive_head:bool=False):
+    """the rule of atoms with the atoms in random order and randomly named variables, like rule_rudik every atom has its own variables"""
+    atoms = list(atoms)
+    rng.shuffle(atoms)
+    names = [f"?v{i}" for i in range(2 * len(atoms))]
+    rng.shuffle(names)
+    variables = {0: ["?a"], 1: ["?b"]}
+    if reflexive_head:
+        variables[0].append("?b")
+        variables[1] = variables[0]
+    body = []
+    for i, (s, p, o) in enumerate(atoms):
+        var_s, var_o = names[2 * i], names[2 * i + 1]
+        variables.setdefault(s, []).append(var_s)
+        variables.setdefault(o, []).append(var_o)
+        body.append((var_s, p, var_o))
+    connections = {tuple(sorted(c)) for c in variables.values() if len(c) > 1}
+    return Rule(HEAD, body, connections)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_canonical_ignores_atom_order_and_variable_names(seed):
+    rng = random.Random(seed)
+    for _ in range(300):
+        atoms = random_body(rng)
+        reflexive_head = rng.random() < 0.1
+        keys = {build(atoms, rng, reflexive_head).canonical().key for _ in range(6)}
+        assert len(keys) == 1, atoms
+
+
+def test_canonical_is_idempotent():
+    rng = random.Random(0)
+    for _ in range(300):
+        canonical = build(random_body(rng), rng).canonical()
+        assert canonical.canonical() == canonical
+
+
+def test_canonical_keeps_different_rules_apart():
+    # same predicates, but the second rule doesn't close at the head object
+    closed = build([(0, "parent", 2), (2, "spouse", 1)], random.Random(0))
+    dangling = build([(0, "parent", 2), (2, "spouse", 3)], random.Random(0))
+    inverted = build([(0, "parent", 2), (1, "spouse", 2)], random.Random(0))
+    assert len({closed.canonical(), dangling.canonical(), inverted.canonical()}) == 3
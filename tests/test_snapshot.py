@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import RuleMining.Util as Util
+from RuleMining.Classes import FrozenGraph, IncidenceList, MappedTermDict, TermDict
+from RuleMining.Util import load_graph, load_snapshot, parseGraph
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "Data", "Transformed_FrenchRoyalty", "TransformedKG_FrenchRoyalty.nt")
+PREFIX = "http://FrenchRoyalty.org/"
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "graph.nt"
+    shutil.copyfile(SOURCE, path)
+    return str(path)
+
+
+def decoded_triples(graph:FrozenGraph):
+    """the triples of graph as terms"""
+    return {(graph.decode(s), graph.decode(p), graph.decode(o)) for p in graph.predicates() for s, o in graph.pairs(p)}
+
+
+def no_parsing(monkeypatch):
+    """makes load_graph fail if it parses the source instead of loading the snapshot"""
+    def fail(*args, **kwargs):
+        raise AssertionError("source was parsed again")
+    monkeypatch.setattr(Util, "parseGraph", fail)
+    monkeypatch.setattr(Util, "merge_ntriples_parallel", fail)
+
+
+def test_snapshot_is_loaded_without_parsing(source, tmp_path, monkeypatch):
+    snapshot = str(tmp_path / "snapshot")
+    built = load_graph(source, PREFIX, snapshot)
+    assert isinstance(built.terms, TermDict)
+
+    no_parsing(monkeypatch)
+    loaded = load_graph(source, PREFIX, snapshot)
+    assert isinstance(loaded.terms, MappedTermDict)
+    assert len(loaded) == len(built)
+    assert decoded_triples(loaded) == decoded_triples(built)
+
+
+def test_touched_source_keeps_snapshot(source, tmp_path, monkeypatch):
+    snapshot = str(tmp_path / "snapshot")
+    load_graph(source, PREFIX, snapshot)
+    mtime_ns = os.stat(source).st_mtime_ns + 10**9
+    os.utime(source, ns=(mtime_ns, mtime_ns))
+
+    no_parsing(monkeypatch)
+    assert isinstance(load_graph(source, PREFIX, snapshot).terms, MappedTermDict)
+    with open(os.path.join(snapshot, "meta.json")) as f:
+        assert json.load(f)["mtime_ns"] == mtime_ns
+
+
+@pytest.mark.parametrize("same_size", [True, False])
+def test_changed_source_rebuilds_snapshot(source, tmp_path, same_size):
+    snapshot = str(tmp_path / "snapshot")
+    before = decoded_triples(load_graph(source, PREFIX, snapshot))
+
+    with open(source, "rb") as f:
+        content = f.read()
+    if same_size:
+        # only the content hash can tell
+        content = content.replace(f"<{PREFIX}Person>".encode(), f"<{PREFIX}PersoN>".encode(), 1)
+    else:
+        content += f"<{PREFIX}a> <{PREFIX}added> <{PREFIX}b> .\n".encode()
+    with open(source, "wb") as f:
+        f.write(content)
+
+    assert load_snapshot(snapshot, source, PREFIX) == None
+    rebuilt = load_graph(source, PREFIX, snapshot)
+    assert isinstance(rebuilt.terms, TermDict)
+    assert decoded_triples(rebuilt) != before
+    assert isinstance(load_snapshot(snapshot, source, PREFIX).terms, MappedTermDict)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_snapshot_matches_parsed_graph(source, tmp_path, workers):
+    snapshot = str(tmp_path / "snapshot")
+    load_graph(source, PREFIX, snapshot, workers)
+    loaded = load_snapshot(snapshot, source, PREFIX)
+    assert isinstance(loaded.terms, MappedTermDict)
+
+    kg = IncidenceList()
+    parseGraph(source, kg, PREFIX)
+    assert len(loaded) == len(kg.triples())
+    assert decoded_triples(loaded) == kg.triples()